@@ -0,0 +1,337 @@
+""" Combine Speech Task Controller data files into a single
+    table, with per-subject/condition/level summaries.
+
+    Finds session .csv files in one or more directories
+    (including subdirectories), checks that their columns
+    match the fields written by the Speech Task Controller,
+    and parses them in parallel. A manifest in the output
+    directory records every file already processed, so
+    re-runs only read new or changed files.
+
+    Output (in OUT):
+        trials.csv: every trial from every valid file, with
+            the source file and session date
+        trials.parquet: same as trials.csv (with --parquet;
+            requires pyarrow or fastparquet)
+        summary.csv: trials, sessions, percent sentences
+            correct and percent words correct for each
+            subject, condition and level
+        rejected.csv: files that could not be used, and why
+        fits.csv: psychometric function fitted to the key word
+            scores of each subject and condition, with
+            bootstrap confidence intervals (with --fit)
+        manifest.json, trials.pkl: state for the next run
+
+    Usage:
+        python aggregate.py DATA_DIR [DATA_DIR ...] --out OUT
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import os
+import re
+import sys
+import json
+import argparse
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+# Import data science packages
+import pandas as pd
+
+# Import custom modules
+from models import sessionmodel as m_sesspars
+from models import scoremodel as m_score
+from models import fitmodel as m_fit
+
+
+#########
+# BEGIN #
+#########
+# Columns written by controller._main_save, with their types
+FIELD_TYPES = {key: data['type']
+    for key, data in m_sesspars.SessionParsModel.fields.items()
+    if key not in m_sesspars.SessionParsModel.not_saved}
+FIELD_TYPES.update({key: data['type']
+    for key, data in m_score.ScoreModel.fields.items()})
+
+# Columns every file must have (older versions may lack others)
+REQUIRED = ('Subject', 'Condition', 'new_db_lvl', 'Trial', 'Outcome',
+    'Num Words Correct', 'Words Correct', 'Words Incorrect')
+
+# Date stamp in data file names: subject_condition_2023_Jan_17_1530_.csv
+DATESTAMP = re.compile(r'(\d{4}_[A-Za-z]{3}_\d{2}_\d{4})_\.csv$')
+
+# Number of files sent to a worker at a time
+CHUNKSIZE = 64
+
+
+def find_files(directories, pattern):
+    """ Return all data files under the given directories
+    """
+    files = []
+    for directory in directories:
+        files.extend(str(path.resolve())
+            for path in Path(directory).rglob(pattern))
+    return sorted(set(files))
+
+
+def read_file(file_path):
+    """ Read and validate one data file (runs in a worker
+        process). Returns (file_path, dataframe or None,
+        reason for rejecting).
+    """
+    try:
+        # Read as text; types are converted once for all files
+        data = pd.read_csv(file_path, dtype=str, keep_default_na=False)
+    except Exception as e:
+        return file_path, None, f"Could not read file: {e}"
+
+    unknown = [col for col in data.columns if col not in FIELD_TYPES]
+    if unknown:
+        return file_path, None, f"Unknown columns: {', '.join(unknown)}"
+    missing = [col for col in REQUIRED if col not in data.columns]
+    if missing:
+        return file_path, None, f"Missing columns: {', '.join(missing)}"
+    if data.empty:
+        return file_path, None, "No trials"
+
+    data['Source'] = os.path.basename(file_path)
+    data['_path'] = file_path
+    match = DATESTAMP.search(file_path)
+    data['Session Date'] = (
+        datetime.strptime(match.group(1), '%Y_%b_%d_%H%M').isoformat()
+        if match else '')
+    return file_path, data, None
+
+
+def convert_types(trials):
+    """ Convert columns to the types given by the models
+    """
+    for col, kind in FIELD_TYPES.items():
+        if col not in trials:
+            continue
+        if kind in ('int', 'float'):
+            # Blank or invalid values become missing
+            values = pd.to_numeric(trials[col], errors='coerce')
+            trials[col] = values.astype('Int64') if kind == 'int' and \
+                (values.dropna() % 1 == 0).all() else values
+    return trials
+
+
+def summarize(trials):
+    """ Per subject, condition and level: number of trials and
+        sessions, percent sentences correct and percent words
+        correct
+    """
+    trials = trials.assign(
+        words_total=trials['Num Words Correct'].astype(float)
+            + trials['Words Incorrect'].fillna('').str.split().str.len(),
+        outcome=trials['Outcome'].astype(float)
+    )
+    summary = trials.groupby(['Subject', 'Condition', 'new_db_lvl']).agg(
+        Trials=('Trial', 'size'),
+        Sessions=('Source', 'nunique'),
+        Sentences_Correct=('outcome', 'sum'),
+        Words_Correct=('Num Words Correct', 'sum'),
+        Words_Total=('words_total', 'sum')
+    ).reset_index()
+    summary['PC Sentence'] = (summary['Sentences_Correct']
+        / summary['Trials'] * 100).round(2)
+    summary['PC Word'] = (summary['Words_Correct'].astype(float)
+        / summary['Words_Total'] * 100).round(2)
+    return summary.rename(columns={'Sentences_Correct': 'Sentences Correct',
+        'Words_Correct': 'Words Correct', 'Words_Total': 'Words Total'})
+
+
+def fit_groups(summary, function='logistic', n_boot=m_fit.N_BOOT,
+    seed=m_fit.SEED, executor=None):
+    """ Fit a psychometric function to the per-level key word
+        scores of each subject and condition (SUMMARY from
+        summarize). Groups with fewer than 3 levels get a note
+        instead of a fit.
+    """
+    rows = []
+    for (subject, condition), group in summary.groupby(
+        ['Subject', 'Condition']):
+        row = {'Subject': subject, 'Condition': condition,
+            'Function': function, 'Levels': len(group)}
+        try:
+            result = m_fit.fit_with_ci(group['new_db_lvl'].astype(float),
+                group['Words Correct'].astype(float),
+                group['Words Total'].astype(float), function,
+                n_boot=n_boot, seed=seed, executor=executor)
+        except ValueError as e:
+            row['Note'] = str(e)
+            rows.append(row)
+            continue
+        for name, label in (('srt', 'SRT'), ('threshold', 'Threshold'),
+            ('slope', 'Slope'), ('lapse', 'Lapse')):
+            low, high = result['ci'][name]
+            row.update({label: result[name], f"{label} Low": low,
+                f"{label} High": high})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+class Aggregator:
+    """ Incrementally combine data files into OUT_DIR
+    """
+    def __init__(self, out_dir):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_file = self.out_dir / 'manifest.json'
+        self.store_file = self.out_dir / 'trials.pkl'
+        self.manifest = self._load_manifest()
+
+
+    def run(self, files, workers=None, parquet=False, fit=None, 
+        n_boot=m_fit.N_BOOT):
+        """ Process new/changed files and write all outputs.
+            FIT is a psychometric function name (or None for no
+            fits).
+        """
+        # Only read files that are new or have changed
+        todo = []
+        current = dict()
+        for file_path in files:
+            st = os.stat(file_path)
+            current[file_path] = {'mtime': st.st_mtime_ns, 'size': st.st_size}
+            entry = self.manifest.get(file_path)
+            if entry is None or entry['mtime'] != st.st_mtime_ns or \
+                entry['size'] != st.st_size:
+                todo.append(file_path)
+        print(f"Aggregator: {len(files)} files found, {len(todo)} new or " +
+            "changed")
+
+        # Keep stored trials from unchanged files
+        todo_set = set(todo)
+        trials = self._load_store()
+        keep = {path for path in current if path not in todo_set and
+            self.manifest.get(path, {}).get('status') == 'ok'}
+        parts = [trials.loc[trials['_path'].isin(keep)]] \
+            if trials is not None else []
+
+        # Read files in parallel
+        manifest = {path: self.manifest[path] for path in current
+            if path not in todo_set}
+        if todo:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(read_file, todo, chunksize=CHUNKSIZE)
+                for count, (file_path, data, reason) in enumerate(results, 1):
+                    entry = dict(current[file_path])
+                    if data is None:
+                        entry.update(status='rejected', reason=reason)
+                    else:
+                        entry.update(status='ok', rows=len(data))
+                        parts.append(data)
+                    manifest[file_path] = entry
+                    if count % 1000 == 0:
+                        print(f"Aggregator: Read {count} of {len(todo)} files")
+
+        if parts:
+            trials = pd.concat(parts, ignore_index=True, sort=False)
+        else:
+            trials = pd.DataFrame(columns=list(FIELD_TYPES) +
+                ['Source', 'Session Date', '_path'])
+
+        # Save state before writing outputs
+        trials.to_pickle(self.store_file)
+        self.manifest = manifest
+        self._save_manifest()
+
+        self._write_outputs(trials, parquet, fit, n_boot, workers)
+        return trials
+
+
+    def _write_outputs(self, trials, parquet, fit=None, n_boot=m_fit.N_BOOT,
+        workers=None):
+        """ Write combined trials, summary and rejected files
+        """
+        # Keep the data file column order
+        columns = [col for col in FIELD_TYPES if col in trials] \
+            + ['Source', 'Session Date']
+        trials = convert_types(trials[columns].copy())
+        trials.to_csv(self.out_dir / 'trials.csv', index=False)
+        if parquet:
+            try:
+                trials.to_parquet(self.out_dir / 'trials.parquet',
+                    index=False)
+            except ImportError:
+                print("Aggregator: Parquet output needs pyarrow or " +
+                    "fastparquet - skipped")
+
+        summary = summarize(trials)
+        summary.to_csv(self.out_dir / 'summary.csv', index=False)
+
+        if fit:
+            # Bootstrap samples for every group share one pool
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                fits = fit_groups(summary, fit, n_boot, executor=executor)
+            fits.to_csv(self.out_dir / 'fits.csv', index=False)
+            print(f"Aggregator: {len(fits)} psychometric fits written")
+
+        rejected = pd.DataFrame([{'File': path, 'Reason': entry['reason']}
+            for path, entry in self.manifest.items()
+            if entry['status'] == 'rejected'], columns=['File', 'Reason'])
+        rejected.to_csv(self.out_dir / 'rejected.csv', index=False)
+        print(f"Aggregator: {len(trials)} trials written to {self.out_dir} " +
+            f"({len(rejected)} files rejected)")
+
+
+    def _load_manifest(self):
+        """ Load record of processed files
+        """
+        if not self.manifest_file.exists():
+            return dict()
+        with open(self.manifest_file, 'r') as fh:
+            return json.load(fh)
+
+
+    def _save_manifest(self):
+        """ Write record of processed files (atomically)
+        """
+        temp = self.manifest_file.with_suffix('.tmp')
+        with open(temp, 'w') as fh:
+            json.dump(self.manifest, fh)
+        os.replace(temp, self.manifest_file)
+
+
+    def _load_store(self):
+        """ Load trials stored by the last run
+        """
+        if not self.store_file.exists() or not self.manifest:
+            return None
+        return pd.read_pickle(self.store_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Combine Speech Task Controller data files.")
+    parser.add_argument('directories', nargs='+',
+        help="Directories to search for data files (recursively)")
+    parser.add_argument('--out', required=True,
+        help="Output directory")
+    parser.add_argument('--pattern', default='*_.csv',
+        help="Data file name pattern (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=None,
+        help="Number of worker processes (default: number of cores)")
+    parser.add_argument('--parquet', action='store_true',
+        help="Also write trials.parquet")
+    parser.add_argument('--fit', choices=m_fit.FUNCTIONS, default=None,
+        help="Fit this psychometric function to each subject and " +
+            "condition (writes fits.csv)")
+    parser.add_argument('--boot', type=int, default=m_fit.N_BOOT,
+        help="Bootstrap resamples per fit (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    files = find_files(args.directories, args.pattern)
+    Aggregator(args.out).run(files, workers=args.workers,
+        parquet=args.parquet, fit=args.fit, n_boot=args.boot)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,20 +18,25 @@
 ###########
 # Imports #
 ###########
+# Start timing before anything else is loaded
+from models import startupmodel as m_startup
+startup = m_startup.StartupReport()
+startup.watch_imports()
+
 # Import GUI packages
 import tkinter as tk
 
 # Import system packages
 import os
 import sys
+import queue
+from pathlib import Path
 from tkinter import messagebox
+from tkinter import filedialog
+from time import monotonic
 
-# Import data science packages
-import numpy as np
-
-# Import misc packages
-import webbrowser
-import markdown
+# Heavy packages (pandas, scipy, sounddevice, markdown) are 
+# imported where they are first needed, not at start-up
 
 # Import custom modules
 # Menu imports
@@ -41,11 +46,15 @@ from models import sessionmodel as m_sesspars
 from models import audiomodel as m_audio
 from models import listmodel as m_list
 from models import csvmodel as m_csv
+from models import writermodel as m_writer
+from models import journalmodel as m_journal
+from models import sqlmodel as m_sql
+from models import trialmodel as m_trial
 from models import scoremodel as m_score
-# View imports
+from models import statsmodel as m_stats
+# View imports (audio dialog is imported when opened)
 from views import main as v_main
 from views import session as v_sess
-from views import audio as v_aud
 from views import calibration as v_cal
 
 
@@ -55,6 +64,9 @@ from views import calibration as v_cal
 class Application(tk.Tk):
     """ Application root window
     """
+    # Milliseconds between checks for save errors
+    poll_ms = 250
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -64,13 +76,8 @@ class Application(tk.Tk):
         self.resizable(False, False)
         self.grab_set()
 
-        # Dictionary to track values per trial
-        # Used to calculate summary stats
-        self.tracker = {
-            'Level': [], # Adjusted presentation levels
-            'PC Word': [], # Number of words correct
-            'Outcome': [], # Outcome (1/0; right/wrong)
-        }
+        # Per-level summary stats, updated with each trial
+        self.stats = m_stats.RunningStats()
 
 
         ######################################
@@ -83,20 +90,30 @@ class Application(tk.Tk):
         # Create CSV writer model
         self.csvmodel = m_csv.CSVModel(self.sessionpars)
 
-        # Create and load list model
+        # Create session journal (for resuming a session)
+        self.journal = m_journal.Journal()
+
+        # Write records on a background thread
+        # Sink errors are passed from the writer thread through
+        # a queue, which the GUI polls (Tk must only be called
+        # from this thread)
+        self._save_errors = queue.Queue()
+        self.writer = m_writer.RecordWriter([self.journal, self.csvmodel],
+            on_error=self._save_errors.put)
+
+        # Create list model (stimuli are loaded at START or when 
+        # the session dialog is submitted)
         self.listmodel = m_list.StimulusList(self.sessionpars)
-        # Maybe don't even try loading listmodel here due to randomization?
-        try:
-            self.listmodel.load()
-        except FileNotFoundError:
-            pass
 
         # Create score model
         self.scoremodel = m_score.ScoreModel()
 
+        # Create audio player (one output stream for all presentations)
+        self.player = m_audio.Player()
+
         # Create main view
         self.main_frame = v_main.MainFrame(self, self.scoremodel, 
-            self.sessionpars, self.listmodel)
+            self.sessionpars, self.listmodel, self.player)
         self.main_frame.grid()
 
         # Create menus
@@ -110,6 +127,7 @@ class Application(tk.Tk):
         event_callbacks = {
             # File menu
             '<<FileSession>>': lambda _: self._show_session_dialog(),
+            '<<FileResume>>': lambda _: self._resume_session(),
             '<<FileQuit>>': lambda _: self._quit(),
 
             # Tools menu
@@ -124,6 +142,7 @@ class Application(tk.Tk):
 
             # Calibration dialog commands
             '<<PlayCalStim>>': lambda _: self._play_calibration(),
+            '<<CalFileLoaded>>': lambda _: self._measure_calibration(),
             '<<CalibrationSubmit>>': lambda _: self._calc_level(),
 
             # Audio dialog commands
@@ -132,8 +151,7 @@ class Application(tk.Tk):
             # Mainframe commands
             '<<SubmitResponse>>': lambda _: self._on_main_submit(),
             '<<MainDone>>': lambda _: self._main_done(),
-            '<<GetLevel>>': lambda _: self._calc_level(),
-            '<<MainStart>>': lambda _: self._disable_mnu()
+            '<<MainStart>>': lambda _: self._on_main_start(),
         }
 
         # Bind callbacks to sequences
@@ -142,6 +160,11 @@ class Application(tk.Tk):
 
         # Center main window
         self.center_window()
+        startup.mark('window created')
+        self.after_idle(self._on_first_paint)
+
+        # Check for save errors from the writer thread
+        self.after(self.poll_ms, self._poll_save_errors)
 
 
     #####################
@@ -160,6 +183,14 @@ class Application(tk.Tk):
         self.deiconify()
 
 
+    def _on_first_paint(self):
+        """ Record time to first paint and report start-up times
+        """
+        startup.mark('first paint')
+        startup.report()
+        self._measure_calibration()
+
+
     def resource_path(self, relative_path):
         """ Get the absolute path to compiled resources
         """
@@ -175,6 +206,9 @@ class Application(tk.Tk):
     def _quit(self):
         """ Exit the application
         """
+        self.player.close()
+        self._close_writer()
+        self.sessionpars_model.flush()
         self.destroy()
 
 
@@ -184,6 +218,8 @@ class Application(tk.Tk):
     def _show_help(self):
         """ Create html help file and display in default browser
         """
+        import webbrowser
+
         print('Looking for help file in compiled version temp location...')
         help_file = self.resource_path('README\\README.html')
         file_exists = os.access(help_file, os.F_OK)
@@ -191,6 +227,7 @@ class Application(tk.Tk):
             print('Not found!\nChecking for help file in ' +
                 'local script version location')
             # Read markdown file and convert to html
+            import markdown
             with open('README.md', 'r') as f:
                 text = f.read()
                 html = markdown.markdown(text)
@@ -210,9 +247,51 @@ class Application(tk.Tk):
     # Main Frame Functions #
     ########################
     def _disable_mnu(self):
-        """ Disable FILE>Session... menu once task has started
+        """ Disable FILE>Session... and FILE>Resume Session... 
+            menus once task has started
         """
         self.menu.file_menu.entryconfig('Session...', state='disabled')
+        self.menu.file_menu.entryconfig('Resume Session...', 
+            state='disabled')
+
+
+    def _on_main_start(self):
+        """ Disable session menus and start the session journal
+        """
+        self._disable_mnu()
+
+        # A resumed session appends to its existing journal
+        if not self.journal.is_open:
+            self._begin_journal()
+
+        # Also write records to the results database, if chosen
+        db_path = self.sessionpars['Results Database'].get()
+        if db_path:
+            self.writer.add_sink(m_sql.ResultsDB(db_path, 
+                session=self.csvmodel.path().name))
+
+
+    def _begin_journal(self):
+        """ Write the session journal header: everything 
+            needed to rebuild the trial sequence
+        """
+        trials = self.main_frame.trials
+        header = {
+            'datestamp': self.csvmodel.datestamp,
+            'sessionpars': {key: var.get() 
+                for key, var in self.sessionpars.items()},
+            'seed': self.scoremodel.fields['Random Seed'],
+            'order': trials.order.tolist(),
+            'trials': trials.to_dict()
+        }
+        try:
+            self.journal.begin(self.csvmodel.path(), header)
+        except OSError as e:
+            print(f"App: Could not start session journal: {e}")
+            messagebox.showwarning(title="Journal Not Saved",
+                message="Could not create the session journal!",
+                detail="Data will still be saved, but this session " +
+                    "cannot be resumed if the app closes unexpectedly.")
 
 
     def _on_main_submit(self):
@@ -225,17 +304,13 @@ class Application(tk.Tk):
         print(f"Incorrect: {self.scoremodel.fields['Words Incorrect']}")
         print(f"Outcome code: {self.scoremodel.fields['Outcome']}\n")
 
-        # Track values for summary at end
-        self.tracker['Level'].append(self.sessionpars['new_db_lvl'].get())
-        self.tracker['PC Word'].append(self.scoremodel.fields['Num Words Correct'])
-        self.tracker['Outcome'].append(self.scoremodel.fields['Outcome'])
-
         # Call save function
         self._main_save()
         
         
     def _main_save(self):
-        """ Format values and send to csv model
+        """ Format values, update summary stats and send to 
+            the writer
         """
         # Get tk variable values from sessionpars
         data = dict()
@@ -243,48 +318,124 @@ class Application(tk.Tk):
             data[key] = self.sessionpars[key].get()
 
         # Only write specific sessionpars to file
-        drop_list = ['Speaker Number', 'Audio Files Path', 
-            'Sentence File Path', 'Audio Device ID', 'Calibration File']
-        [data.pop(e) for e in drop_list]
+        [data.pop(e) for e in self.sessionpars_model.not_saved]
 
         # Combine sessionpars dict and scoremodel dict for writing
         data.update(self.scoremodel.fields)
 
-        # Save data
-        print('App_206: Calling save record function...')
-        try:
-            self.csvmodel.save_record(data)
-        except PermissionError():
-            messagebox.showerror(title="Save Failed!",
-                message="Could not save data to file!",
-                detail="Please make sure the file isn't open and that you " +
-                    "have write permission."
-            )
+        # Track values for summary at end
+        self.stats.add_record(data)
+
+        # Queue data for the writer thread
+        print('App_206: Queueing record for saving...')
+        self.writer.put(data)
+
+
+    def _poll_save_errors(self, repeat=True):
+        """ Show one error message for any save errors passed
+            from the writer thread since the last check
+        """
+        failed = False
+        behind = False
+        while True:
+            try:
+                error = self._save_errors.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(error, m_writer.WriterBehind):
+                behind = True
+            else:
+                failed = True
+        if failed:
+            self._show_save_error()
+        elif behind:
+            self._show_save_delay()
+        if repeat:
+            self.after(self.poll_ms, self._poll_save_errors)
+
+
+    def _close_writer(self):
+        """ Write all queued records and close the writer, 
+            keeping the window responsive while waiting
+        """
+        deadline = monotonic() + self.writer.close_timeout
+        while not self.writer.close(timeout=self.poll_ms / 1000):
+            if monotonic() > deadline:
+                print("App: Timed out waiting for records to be saved!")
+                self._save_errors.put(TimeoutError())
+                break
+            self.update()
+
+
+    def _show_save_error(self):
+        """ Display save error message
+        """
+        messagebox.showerror(title="Save Failed!",
+            message="Could not save data to file!",
+            detail="Please make sure the file isn't open and that you " +
+                "have write permission."
+        )
+
+
+    def _show_save_delay(self):
+        """ Display slow saving warning
+        """
+        messagebox.showwarning(title="Saving Delayed",
+            message="Trials are being saved slowly.",
+            detail="Scored trials are kept and will be saved once " +
+                "the data file is available again. Please don't close " +
+                "the app until saving has finished."
+        )
 
 
     def _main_done(self):
         """ Calculate and display summary stats. Close app.
         """
-        # Calculate some descriptive statistics for display
-        num_keywords = len(self.scoremodel.fields['Words Correct'].split()) \
-            + len(self.scoremodel.fields['Words Incorrect'].split())
-        print(f'Words per sentence: {num_keywords}')
-        print(f"Total words correct: {np.sum(self.tracker['PC Word'])}")
-        print(f"Total number of sentences: {len(self.tracker['Outcome'])}")
-        print(f"Tracker list of levels: {self.tracker['Level']}")
-        pc_word = round((np.sum(self.tracker['PC Word']) / (len(self.tracker['Outcome'] * num_keywords))) * 100, 2)
-       
-        # Summary stats messagebox
+        # Write all queued records before showing the summary
+        self._close_writer()
+        # Show any save errors from the last records
+        self._poll_save_errors(repeat=False)
+
+        # Display summary stats
+        summary = self.stats.summary_text()
+        fit = self._fit_summary()
+        if fit:
+            summary += '\n\n' + fit
+        print(f"\nSession summary:\n{summary}")
         messagebox.showinfo(
             title='Done!',
             message='Summary',
-            detail=f'Percent Correct (Total Words): {pc_word}%'
+            detail=summary
         )
 
         # Close app when done
+        self.player.close()
+        self.sessionpars_model.flush()
         self.quit()
 
 
+    def _fit_summary(self):
+        """ Fit a psychometric function to the per-level key
+            word scores, with bootstrap confidence intervals.
+            Returns the fit as text ('' if it can't be fitted).
+        """
+        # Loads numpy and scipy
+        from models import fitmodel as m_fit
+
+        levels, correct, total = m_fit.from_stats(self.stats)
+        self.config(cursor='watch')
+        self.update_idletasks()
+        try:
+            result = m_fit.fit_with_ci(levels, correct, total)
+        except ValueError as e:
+            # E.g., fewer than 3 presentation levels
+            print(f"App: No psychometric fit: {e}")
+            return ''
+        finally:
+            self.config(cursor='')
+        return m_fit.summary_text(result)
+
+
     ############################
     # Session Dialog Functions #
     ############################
@@ -321,7 +472,66 @@ class Application(tk.Tk):
         print("\nApp_266: Calling sessionpar model set and save funcs...")
         for key, variable in self.sessionpars.items():
             self.sessionpars_model.set(key, variable.get())
-            self.sessionpars_model.save()
+        # Only changed values are written, once changes settle
+        self.sessionpars_model.save()
+
+
+    def _resume_session(self):
+        """ Rebuild a session from its journal and continue 
+            from the next unscored trial, appending to the 
+            same data file
+        """
+        file_path = filedialog.askopenfilename(title="Resume Session",
+            filetypes=[('Session journal', '*.jsonl')])
+        if not file_path:
+            return
+
+        try:
+            header, records = m_journal.load(file_path)
+            trials = m_trial.TrialSequence.from_dict(header['trials'], 
+                header['order'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"App: Could not read journal: {e}")
+            messagebox.showerror(title="Cannot Resume",
+                message="Could not read the session journal!",
+                detail=str(e))
+            return
+
+        # Next trial to present
+        counter = max((int(data['Trial']) for data in records), default=0)
+        if counter >= len(trials):
+            messagebox.showinfo(title="Cannot Resume",
+                message="This session is already complete!")
+            return
+
+        # Restore session parameters (except the audio device, 
+        # which may have changed since)
+        for key, value in header['sessionpars'].items():
+            if key in self.sessionpars and key != 'Audio Device ID' and \
+                value is not None:
+                self.sessionpars[key].set(value)
+
+        # Restore summary values
+        self.stats = m_stats.RunningStats()
+        for data in records:
+            self.stats.add_record(data)
+
+        # Append to the same data file, adding any rows that 
+        # were in the journal but not yet written to it
+        self.csvmodel.file = Path(header['data_file'])
+        try:
+            saved = self.csvmodel.saved_trials()
+        except (OSError, ValueError):
+            saved = set()
+        for data in records:
+            if int(data['Trial']) not in saved:
+                self.writer.put(data, sinks=[self.csvmodel])
+
+        try:
+            self.journal.resume(file_path)
+        except OSError as e:
+            print(f"App: Could not reopen journal: {e}")
+        self.main_frame.resume(trials, counter, header.get('seed', ''))
 
 
     ##########################
@@ -331,6 +541,8 @@ class Application(tk.Tk):
         """ Show audio settings dialog
         """
         print("\nApp_288: Calling audio dialog...")
+        # Loads pandas, pandastable and sounddevice
+        from views import audio as v_aud
         v_aud.AudioDialog(self, self.sessionpars)
 
 
@@ -363,6 +575,15 @@ class Application(tk.Tk):
         self._save_sessionpars()
 
 
+    def _measure_calibration(self):
+        """ Start measuring a long custom calibration file in 
+            the background, so it starts at once when played
+        """
+        cal_file = self.sessionpars['Calibration File'].get()
+        if cal_file and cal_file != 'cal_stim.wav':
+            m_audio.measure_async(cal_file)
+
+
     def _play_calibration(self):
         """ Load and present calibration stimulus
         """
@@ -399,9 +620,14 @@ class Application(tk.Tk):
         # Present calibration stimulus
         print("App_341: Attempting to play calibration file...")
         cal_stim.play(device_id=self.sessionpars['Audio Device ID'].get(), 
-            channels=self.sessionpars['Speaker Number'].get())
+            channels=self.sessionpars['Speaker Number'].get(),
+            player=self.player)
 
 
 if __name__ == "__main__":
+    # Needed for bootstrap worker processes in the compiled app
+    import multiprocessing
+    multiprocessing.freeze_support()
+
     app = Application()
     app.mainloop()
@@ -35,6 +35,10 @@ class MainMenu(tk.Menu):
             label="Session...",
             command=self._event('<<FileSession>>')
         )
+        self.file_menu.add_command(
+            label="Resume Session...",
+            command=self._event('<<FileResume>>')
+        )
         self.file_menu.add_separator()
         self.file_menu.add_command(
             label="Quit",
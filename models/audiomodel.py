@@ -15,23 +15,484 @@ import numpy as np
 
 # Import system packages
 import os
+import queue
+import threading
+from time import monotonic, sleep
+from collections import OrderedDict
+from collections import deque
 
-# Import audio packages
-import sounddevice as sd
-from scipy.io import wavfile
-
+# Audio packages (sounddevice, scipy) are imported on first 
+# use to keep application start-up fast
 
+# Import custom modules
+from models import indexmodel
 
 
 #########
 # BEGIN #
 #########
+class AudioCache:
+    """ Process-wide, byte-budgeted LRU cache of decoded .wav 
+        files, stored as float32. Entries are keyed by path, modification time 
+        and file size, so an edited file is never served 
+        stale. Least recently used entries are evicted once 
+        the total size of the cached arrays exceeds max_bytes.
+
+        Cached arrays are marked read-only because they are 
+        shared between Audio objects.
+    """
+    def __init__(self, max_bytes=256*1024*1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def _key(file_path):
+        """ Build cache key from path, mtime and size. 
+            Raises FileNotFoundError for missing files.
+        """
+        st = os.stat(file_path)
+        return (os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
+
+
+    def read(self, file_path):
+        """ Return (fs, audio, data_type) for file_path, where 
+            audio is float32 scaled to +/-1 and data_type is 
+            the file's original data type. Reads from disk 
+            only on a cache miss.
+        """
+        key = self._key(file_path)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        # Read outside the lock so slow disks don't block other readers
+        from scipy.io import wavfile
+        fs, audio_file = wavfile.read(file_path)
+        data_type = audio_file.dtype
+        sig = to_float32(audio_file)
+        sig.flags.writeable = False
+        self.put(key, (fs, sig, data_type))
+        return fs, sig, data_type
+
+
+    def put(self, key, entry):
+        """ Store an entry and evict the least recently 
+            used entries until under budget. Entries larger 
+            than the entire budget are not stored.
+        """
+        size = entry[1].nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = entry
+            self.nbytes += size
+            self._evict()
+
+
+    def resize(self, max_bytes):
+        """ Change the memory ceiling, evicting as needed 
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+
+    def clear(self):
+        """ Drop all cached audio 
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+    def _evict(self):
+        """ Remove least recently used entries until the 
+            cache fits within max_bytes. Caller holds the lock.
+        """
+        while self.nbytes > self.max_bytes and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= old[1].nbytes
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared cache used by all Audio objects
+cache = AudioCache()
+
+
+class BlockSource:
+    """ Audio read block by block from a memory-mapped .wav 
+        file. Each requested slice is converted to float32 
+        and scaled (data type and level) on demand, so long 
+        files start immediately and use constant memory.
+
+        Slicing returns a samples x channels float32 array.
+    """
+    ndim = 2
+
+    def __init__(self, raw, data_type, gains=None):
+        self.raw = raw
+        self.data_type = str(data_type)
+        channels = 1 if raw.ndim == 1 else raw.shape[1]
+        self.shape = (len(raw), channels)
+
+        # Combined data type and level scaling per channel
+        scale = np.ones(channels)
+        if self.data_type in Audio.wav_dict:
+            scale = scale / Audio.wav_dict[self.data_type][1]
+        if gains is not None:
+            scale = scale * gains
+        self.scale = scale.astype(np.float32)
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    def __getitem__(self, index):
+        block = np.array(self.raw[index], dtype=np.float32)
+        block = block.reshape(len(block), -1)
+        block *= self.scale
+        return block
+
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+
+
+    def blocks(self, frames=2**20):
+        """ Iterate over the whole file in blocks 
+        """
+        for start in range(0, len(self), frames):
+            yield self[start:start+frames]
+
+
+class BlockFeeder:
+    """ Reads a BlockSource ahead of playback on a feeder
+        thread, holding up to AHEAD blocks in memory. The
+        audio callback only copies from these blocks, so it
+        never waits on the memory-mapped file (e.g., a page
+        fault on a network share).
+
+        If the feeder falls behind, read() returns None and
+        the callback plays silence until the next block
+        arrives (counted in self.underruns).
+    """
+    block_frames = 2**15
+    ahead = 8
+
+    def __init__(self, source):
+        self.source = source
+        self.error = None
+        self.underruns = 0
+        self._blocks = deque()
+        self._block = None
+        self._offset = 0
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+            name='block-feeder', daemon=True)
+        self._thread.start()
+
+
+    def wait_ready(self, timeout=2.0):
+        """ Wait until the first block is in memory
+        """
+        return self._ready.wait(timeout)
+
+
+    def read(self, frames):
+        """ Return up to FRAMES samples from memory, or None 
+            if the next block isn't loaded yet (audio thread)
+        """
+        if self._block is None or self._offset >= len(self._block):
+            try:
+                # deque.popleft is atomic: no lock needed
+                self._block = self._blocks.popleft()
+            except IndexError:
+                return None
+            self._offset = 0
+        block = self._block[self._offset:self._offset+frames]
+        self._offset += len(block)
+        return block
+
+
+    def stop(self):
+        """ Stop reading ahead
+        """
+        self._stop.set()
+
+
+    def _run(self):
+        """ Read blocks ahead of playback (feeder thread)
+        """
+        try:
+            for block in self.source.blocks(self.block_frames):
+                while len(self._blocks) >= self.ahead:
+                    if self._stop.wait(0.01):
+                        return
+                if self._stop.is_set():
+                    return
+                self._blocks.append(block)
+                self._ready.set()
+        except Exception as e:
+            print(f"Models_audiomodel: Could not read audio file: {e}")
+            self.error = e
+        finally:
+            self._ready.set()
+
+
+class Player:
+    """ Long-lived, low-latency output stream shared by all 
+        presentations. The stream is opened once per device, 
+        sample rate and channel count, and kept running 
+        (outputting silence when idle). Leveled buffers are 
+        handed to the stream callback through a queue.
+
+        An optional ON_DONE callable is run once the last 
+        sample of a buffer has reached the output (based on 
+        the stream's DAC timing), or straight away if the 
+        buffer is interrupted or stopped first, so every 
+        ON_DONE is called exactly once. It runs on a separate 
+        notifier thread, never on the audio thread.
+
+        Memory-mapped audio (BlockSource) is read ahead by a
+        BlockFeeder; the audio thread only copies from memory.
+    """
+    def __init__(self, latency='low'):
+        self.latency_setting = latency
+        self.stream = None
+        self.config = None
+        self._queue = deque()
+        self._current = None
+        self._lock = threading.Lock()
+
+        # Completion notifications
+        self._done = queue.Queue()
+        self._notifier = threading.Thread(target=self._notify, 
+            name='playback-notifier', daemon=True)
+        self._notifier.start()
+
+
+    @property
+    def latency(self):
+        """ Reported output latency of the open stream (s) 
+        """
+        if self.stream is None:
+            return None
+        return self.stream.latency
+
+
+    def open(self, device_id, fs, num_channels):
+        """ Open the output stream, unless one with the same 
+            configuration is already running
+        """
+        config = (device_id, fs, num_channels)
+        if self.stream is not None and self.config == config:
+            return
+
+        import sounddevice as sd
+        self.close()
+        self.stream = sd.OutputStream(
+            samplerate=fs,
+            device=device_id,
+            channels=num_channels,
+            dtype='float32',
+            latency=self.latency_setting,
+            callback=self._callback
+        )
+        self.stream.start()
+        self.config = config
+        print("Models_audiomodel: Opened output stream " +
+            f"(device: {device_id}, fs: {fs}, channels: {num_channels}, " +
+            f"latency: {self.latency*1000:.1f} ms)")
+
+
+    def play(self, data, fs, device_id, mapping, interrupt=True, 
+        on_done=None):
+        """ Queue a buffer for presentation.
+
+            DATA: samples x channels (or 1-D for mono)
+            MAPPING: output channel number(s), starting at 1, 
+                for each column of DATA. Mono data are played 
+                on all given channels. A single channel number 
+                with multichannel data maps the columns to 
+                consecutive channels starting there (e.g., a 
+                4-channel file on speaker 5 uses speakers 5-8).
+            INTERRUPT: stop any current presentation first 
+                (like sd.play). Otherwise play after it.
+            ON_DONE: called when presentation has finished, or 
+                at once if the buffer is interrupted or stopped.
+        """
+        if not isinstance(data, BlockSource):
+            data = np.asarray(data, dtype=np.float32)
+            if data.ndim == 1:
+                data = data.reshape(-1, 1)
+        mapping = np.atleast_1d(mapping).astype(int) - 1
+        if len(mapping) == 1 and data.shape[1] > 1:
+            mapping = mapping[0] + np.arange(data.shape[1])
+        if np.any(mapping < 0):
+            raise ValueError("Channel numbers start at 1")
+        if data.shape[1] != 1 and data.shape[1] != len(mapping):
+            raise ValueError("Number of channels must match mapping")
+
+        # Open (or reuse) stream wide enough for the mapped channels
+        self.open(device_id, fs, int(mapping.max()) + 1)
+
+        # Start reading memory-mapped audio ahead of playback
+        feeder = None
+        if isinstance(data, BlockSource):
+            feeder = BlockFeeder(data)
+            feeder.wait_ready()
+
+        buffer = {'data': data, 'mapping': mapping, 'pos': 0, 
+            'on_done': on_done, 'feeder': feeder}
+        with self._lock:
+            if interrupt:
+                self._cancel()
+            self._queue.append(buffer)
+
+
+    def stop(self):
+        """ Stop the current and any queued presentations 
+        """
+        with self._lock:
+            self._cancel()
+
+
+    def _cancel(self):
+        """ Drop the current and queued buffers, and report 
+            them as done (call with lock held)
+        """
+        buffers = list(self._queue)
+        if self._current is not None:
+            buffers.insert(0, self._current)
+        self._queue.clear()
+        self._current = None
+        for buffer in buffers:
+            if buffer['feeder'] is not None:
+                buffer['feeder'].stop()
+            if buffer['on_done'] is not None:
+                self._done.put((buffer['on_done'], monotonic()))
+
+
+    def close(self):
+        """ Stop and close the output stream 
+        """
+        self.stop()
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            print("Models_audiomodel: Closed output stream")
+        self.stream = None
+        self.config = None
+
+
+    def _callback(self, outdata, frames, time, status):
+        """ Copy queued audio into the output buffer 
+            (runs on the audio thread)
+        """
+        outdata.fill(0)
+        filled = 0
+        with self._lock:
+            while filled < frames:
+                if self._current is None:
+                    if not self._queue:
+                        break
+                    self._current = self._queue.popleft()
+
+                buffer = self._current
+                start = buffer['pos']
+                n = min(frames - filled, len(buffer['data']) - start)
+                feeder = buffer['feeder']
+                if feeder is None:
+                    block = buffer['data'][start:start+n]
+                else:
+                    # Memory-mapped audio: only copy blocks already 
+                    # read by the feeder thread
+                    block = feeder.read(n)
+                    if block is None:
+                        if feeder.error is None:
+                            # Feeder behind: rest of this output is silent
+                            feeder.underruns += 1
+                            break
+                        # File can't be read: end this buffer
+                        block = buffer['data'][0:0]
+                        buffer['pos'] = len(buffer['data'])
+                    n = len(block)
+                outdata[filled:filled+n, buffer['mapping']] = block
+                buffer['pos'] += n
+                filled += n
+
+                if buffer['pos'] >= len(buffer['data']):
+                    self._current = None
+                    if buffer['on_done'] is not None:
+                        self._finished(buffer['on_done'], time, filled)
+
+
+    def _finished(self, on_done, time, frames):
+        """ Schedule ON_DONE for when the sample at FRAMES into 
+            the current block has been played (audio thread)
+        """
+        fs = self.stream.samplerate
+        if time.outputBufferDacTime:
+            end = time.outputBufferDacTime + frames / fs
+            delay = end - self.stream.time
+        else:
+            # Host API does not report DAC timing
+            delay = self.stream.latency + frames / fs
+        self._done.put((on_done, monotonic() + delay))
+
+
+    def _notify(self):
+        """ Run completion callbacks on time (notifier thread)
+        """
+        while True:
+            on_done, when = self._done.get()
+            delay = when - monotonic()
+            if delay > 0:
+                sleep(delay)
+            try:
+                on_done()
+            except Exception as e:
+                print(f"Models_audiomodel: Playback callback failed: {e}")
+
+
 class Audio:
     """ An object for use with .wav files. Audio objects 
         can read a given .wav file, handle audio data type 
         conversion, and store information about a .wav 
         file.
+
+        Audio is held as float32 only. The original data 
+        and time vector are created on request.
+
+        Files of at least mmap_bytes (e.g., long calibration 
+        and noise files) are memory-mapped instead of read: 
+        their working audio is a BlockSource that is converted 
+        and leveled block by block during playback.
+
+        LEVEL is the raw presentation level (dB FS). GAIN is 
+        the same level as a linear amplitude (e.g., from a 
+        LevelTable); it is calculated from LEVEL if not given.
     """
+    __slots__ = ('directory', 'name', 'file_path', 'level', 'gain', 'leveled',
+        'fs', 'channels', 'dur', 'data_type', 'working_audio', 
+        'rms_vals', 'peak_vals', 'mapped', '_t')
+
+    # Memory-map files at least this large (bytes)
+    mmap_bytes = 16*1024*1024
+
     # Dictionary of data types and ranges for conversions
     wav_dict = {
         'float32': (-1.0, 1.0),
@@ -40,16 +501,21 @@ class Audio:
         'uint8': (0, 255)
     }
 
-    def __init__(self, file_path, level):
+    def __init__(self, file_path, level, gain=None):
         # Parse file path
         self.directory = file_path.split(os.sep) # path only
         self.name = str(file_path.split(os.sep)[-1]) # file name only
         self.file_path = file_path
         self.level = level
+        if gain is None:
+            gain = 10 ** (level / 20)
+        self.gain = gain
+        self.leveled = False
+        self._t = None
 
-        # Read audio file
+        # Read audio file (from cache when possible)
         try:
-            fs, audio_file = wavfile.read(self.file_path)
+            fs, audio_file, data_type = self._read()
         except FileNotFoundError:
             print("Audio_Model_47: Audio file not found!")
             raise FileNotFoundError
@@ -64,63 +530,136 @@ class Audio:
 
         # Assign audio file attributes
         self.fs = fs
-        self.original_audio = audio_file
-        self.dur = len(self.original_audio) / self.fs
-        self.t = np.arange(0, self.dur, 1/self.fs)
+        self.working_audio = audio_file
+        self.dur = len(audio_file) / self.fs
 
         # Get data type
-        #self.data_type = np.dtype(audio_file[0])
-        self.data_type = audio_file.dtype
+        self.data_type = data_type
         print(f"Incoming audio data type: {self.data_type}")
 
-        # Immediately convert to float64 for processing
-        self.convert_to_float()
+        # Get per-channel RMS and peak values
+        self._get_stats()
+
+
+    def _read(self):
+        """ Memory-map large files, otherwise read through 
+            the cache. Returns (fs, audio, data_type).
+        """
+        self.mapped = False
+        if os.stat(self.file_path).st_size >= self.mmap_bytes:
+            from scipy.io import wavfile
+            try:
+                fs, raw = wavfile.read(self.file_path, mmap=True)
+                self.mapped = True
+                print("Models_audiomodel: Memory-mapped large audio file")
+                return fs, BlockSource(raw, raw.dtype), raw.dtype
+            except ValueError:
+                # Data type can't be mapped (e.g., 24-bit)
+                pass
+        return cache.read(self.file_path)
+
+
+    @property
+    def t(self):
+        """ Time vector (s), created on first use 
+        """
+        if self._t is None:
+            self._t = np.arange(0, self.dur, 1/self.fs)
+        return self._t
+
+
+    @property
+    def original_audio(self):
+        """ Audio in its original data type. Not kept in 
+            memory: read from file on request.
+        """
+        from scipy.io import wavfile
+        return wavfile.read(self.file_path)[1]
 
 
     def convert_to_float(self):
-        """ Convert original audio data type to float64 
-            for processing
+        """ Convert original audio data type to float32 
+            for processing (loads memory-mapped files fully)
         """
-        if self.data_type == 'float64':
-            self.working_audio = self.original_audio
+        self.working_audio = to_float32(self.original_audio)
+        self.mapped = False
+        self.leveled = False
+
+
+    def _get_stats(self):
+        """ Look up per-channel RMS and peak values in the 
+            index for this file's directory. Measure and add 
+            them to the index if missing or out of date.
+            Waits for a background measurement of this file
+            (see measure_async) rather than repeating it.
+        """
+        wait_measured(self.file_path)
+        index = indexmodel.get_index(os.path.dirname(self.file_path) or '.')
+        entry = index.lookup(self.file_path)
+        if entry is not None and len(entry['rms']) == self.channels:
+            self.rms_vals = np.array(entry['rms'])
+            self.peak_vals = np.array(entry['peak'])
+        elif self.mapped:
+            self.rms_vals, self.peak_vals = measure_blocks(
+                self.working_audio.blocks())
+            index.update(self.file_path, self.rms_vals, self.peak_vals)
+            # Long files are expensive to scan, so store right away
+            index.save()
         else:
-            # 1. Convert to float64
-            sig = self.original_audio.astype(np.float64)
-            # 2. Divide by original dtype max val
-            sig = sig / self.wav_dict[str(self.data_type)][1]
-            self.working_audio = sig
+            self.rms_vals, self.peak_vals = measure(self.working_audio)
+            index.update(self.file_path, self.rms_vals, self.peak_vals)
+
 
+    def gains(self, amp, eq='n'):
+        """ Linear gain per channel that sets the signal to 
+            AMP (dB), using the stored RMS values instead of 
+            rescanning the signal. See level_gains.
+        """
+        return level_gains(self.rms_vals, amp, eq)
 
-    def play(self, device_id, channels):
-        """ Present working audio """
+
+    def set_level(self):
+        """ Scale working audio to the requested level. Only 
+            applied once, so repeated presentations (and 
+            prefetched objects) are not leveled twice.
+            Level differences between channels (e.g., an ILD) 
+            are preserved.
+        """
+        if self.leveled:
+            return
+
+        gains = target_gains(self.rms_vals, self.gain).astype(np.float32)
+        if self.mapped:
+            # Scaling is applied per block during playback
+            self.working_audio = BlockSource(self.working_audio.raw, 
+                self.data_type, gains)
+        elif self.channels == 1:
+            self.working_audio = self.working_audio * gains[0]
+        else:
+            # Broadcast over all channels (samples x channels)
+            self.working_audio = self.working_audio * gains
+        self.leveled = True
+
+
+    def play(self, device_id, channels, player, on_done=None):
+        """ Present working audio through PLAYER's output stream. 
+            ON_DONE is called when the last sample has played.
+        """
         #print(f"Presenting audio data type: {np.dtype(self.working_audio[0])}")
         print(f"Presenting audio data type: {self.working_audio.dtype}")
-        # plt.subplot(1,3,1)
-        # plt.plot(self.original_audio)
-        # plt.subplot(1,3,2)
-        # plt.plot(self.working_audio)
 
-        sd.default.device = device_id
+        # Level audio (no-op if already done, e.g., by the prefetcher)
+        self.set_level()
 
-        if self.channels == 1:
-            sig = self.setRMS(self.working_audio, self.level)
-            self.working_audio = sig
-        elif self.channels > 1:
-            left = self.setRMS(self.working_audio[:,0], self.level)
-            right = self.setRMS(self.working_audio[:,1], self.level)
-            self.working_audio = np.array([left, right])
-        # plt.subplot(1,3,3)
-        # plt.plot(self.working_audio)
-        # plt.show()
-
-        sd.play(self.working_audio.T, self.fs, mapping=channels)
-        #sd.wait(self.dur+0.5)
+        player.play(self.working_audio, self.fs, device_id, channels, 
+            on_done=on_done)
 
 
     def convert_to_original(self):
         """ Convert back to original audio data type """
-        # 1. Multiply float64 by original data type max
-        sig = self.working_audio * self.wav_dict[str(self.data_type)][1]
+        # 1. Multiply float32 by original data type max
+        # (slicing loads all blocks of a memory-mapped file)
+        sig = self.working_audio[:] * self.wav_dict[str(self.data_type)][1]
         if self.data_type != 'float32':
             # 2. Round to return to integer values
             sig = np.round(sig)
@@ -134,34 +673,25 @@ class Audio:
     def db2mag(db):
         """ 
             Convert decibels to magnitude. Takes a single
-            value or a list of values.
+            value or an array-like of values.
         """
-        # Must use this form to handle negative db values!
-        try:
-            mag = [10**(x/20) for x in db]
-            return mag
-        except:
-            mag = 10**(db/20)
-            return mag
+        return 10 ** (np.asarray(db, dtype=np.float64) / 20)
 
 
     @staticmethod
     def mag2db(mag):
         """ 
             Convert magnitude to decibels. Takes a single
-            value or a list of values.
+            value or an array-like of values.
         """
-        try:
-            db = [20 * np.log10(x) for x in mag]
-            return db
-        except:
-            db = 20 * np.log10(mag)
-            return db
+        return 20 * np.log10(np.asarray(mag, dtype=np.float64))
 
 
-    def rms(self, sig):
+    def rms(self, sig, axis=None):
         """ 
             Calculate the root mean square of a signal. 
+            AXIS: calculate along the given axis (e.g., per 
+                channel) instead of over the whole signal.
             
             NOTE: np.square will return invalid, negative 
                 results if the number excedes the bit 
@@ -171,20 +701,21 @@ class Audio:
             Written by: Travis M. Moore
             Last edited: Feb. 3, 2020
         """
-        theRMS = np.sqrt(np.mean(np.square(sig)))
+        theRMS = np.sqrt(np.mean(np.square(sig), axis=axis))
         return theRMS
 
 
     def setRMS(self, sig, amp, eq='n'):
         """
-            Set RMS level of a 1-channel or 2-channel signal.
+            Set RMS level of a signal with any number of channels.
         
-            SIG: a 1-channel or 2-channel signal
+            SIG: a 1-channel signal, or a multichannel signal 
+                with one channel per row
             AMP: the desired amplitude to be applied to 
                 each channel. Note this will be the RMS 
-                per channel, not the total of both channels.
+                per channel, not the total of all channels.
             EQ: takes 'y' or 'n'. Whether or not to equalize 
-                the levels in a 2-channel signal. For example, 
+                the levels in a multichannel signal. For example, 
                 a signal with an ILD would lose the ILD with 
                 EQ='y', so the default in 'n'.
 
@@ -199,62 +730,167 @@ class Audio:
             Created: Jan. 10, 2022
             Last edited: May 17, 2022
         """
-        #amp = self.level
-        #sig = self.working_audio
-        if len(sig.shape) == 1:
-            rmsdb = self.mag2db(self.rms(sig))
-            refdb = amp
-            diffdb = np.abs(rmsdb - refdb)
-            if rmsdb > refdb:
-                sigAdj = sig / self.db2mag(diffdb)
-            elif rmsdb < refdb:
-                sigAdj = sig * self.db2mag(diffdb)
-            # Edit 5/17/22
-            # Added handling for when rmsdb == refdb
-            elif rmsdb == refdb:
-                sigAdj = sig
-            return sigAdj
-            
-        elif len(sig.shape) == 2:
-            rmsdbLeft = self.mag2db(self.rms(sig[0]))
-            rmsdbRight = self.mag2db(self.rms(sig[1]))
-
-            ILD = np.abs(rmsdbLeft - rmsdbRight) # get lvl diff
-
-            # Determine lvl advantage
-            if rmsdbLeft > rmsdbRight:
-                lvlAdv = 'left'
-                #print("Adv: %s" % lvlAdv)
-            elif rmsdbRight > rmsdbLeft:
-                lvlAdv = 'right'
-                #print("Adv: %s" % lvlAdv)
-            elif rmsdbLeft == rmsdbRight:
-                lvlAdv = None
-
-            #refdb = amp - 3 # apply half amp to each channel
-            refdb = amp
-            diffdbLeft = np.abs(rmsdbLeft - refdb)
-            diffdbRight = np.abs(rmsdbRight - refdb)
-
-            # Adjust left channel
-            if rmsdbLeft > refdb:
-                sigAdjLeft = sig[0] / self.db2mag(diffdbLeft)
-            elif rmsdbLeft < refdb:
-                sigAdjLeft = sig[0] * self.db2mag(diffdbLeft)
-            # Adjust right channel
-            if rmsdbRight > refdb:
-                sigAdjRight = sig[1] / self.db2mag(diffdbRight)
-            elif rmsdbRight < refdb:
-                sigAdjRight = sig[1] * self.db2mag(diffdbRight)
-
-            # If there is a lvl difference to maintain across channels
-            if eq == 'n':
-                if lvlAdv == 'left':
-                    sigAdjLeft = sigAdjLeft * self.db2mag(ILD/2)
-                    sigAdjRight = sigAdjRight / self.db2mag(ILD/2)
-                elif lvlAdv == 'right':
-                    sigAdjLeft = sigAdjLeft / self.db2mag(ILD/2)
-                    sigAdjRight = sigAdjRight * self.db2mag(ILD/2)
-
-            sigBothAdj = np.array([sigAdjLeft, sigAdjRight])
-            return sigBothAdj
+        sig = np.asarray(sig)
+        if sig.ndim == 1:
+            return sig * level_gains([self.rms(sig)], amp, eq)[0]
+        # One gain per row, applied in a single pass
+        gains = level_gains(self.rms(sig, axis=1), amp, eq)
+        return sig * gains[:, np.newaxis]
+
+
+def level_gains(rms, amp, eq='n'):
+    """ Return the linear gain for each channel that sets 
+        its RMS to AMP (dB).
+
+        RMS: per-channel RMS values (linear)
+        EQ: 'y' sets every channel to AMP. 'n' keeps the 
+            level differences between channels (e.g., an ILD), 
+            and sets the mean channel level (dB) to AMP. For 
+            a 2-channel signal the louder channel ends up 
+            ILD/2 above AMP, the softer one ILD/2 below.
+
+        Silent channels are left unchanged (gain of 1).
+    """
+    return target_gains(rms, 10 ** (amp / 20), eq)
+
+
+def target_gains(rms, target, eq='n'):
+    """ Return the linear gain for each channel that sets 
+        its RMS to TARGET (linear amplitude re: full scale).
+        See level_gains.
+    """
+    rms = np.asarray(rms, dtype=np.float64)
+    audible = rms > 0
+    gains = np.ones(len(rms))
+    if not np.any(audible):
+        return gains
+
+    if eq == 'n':
+        # Same gain for every channel, relative to the mean 
+        # channel level in dB (geometric mean RMS)
+        gains[audible] = target / np.exp(np.mean(np.log(rms[audible])))
+    else:
+        gains[audible] = target / rms[audible]
+    return gains
+
+
+def to_float32(audio_file):
+    """ Convert audio data to float32, scaled by the 
+        maximum value of its data type
+    """
+    data_type = str(audio_file.dtype)
+    sig = audio_file.astype(np.float32)
+    if data_type in Audio.wav_dict:
+        sig /= Audio.wav_dict[data_type][1]
+    return sig
+
+
+def measure(sig):
+    """ Return per-channel RMS and peak values of a float
+        signal (samples x channels, or 1-D for mono)
+    """
+    sig = sig.reshape(len(sig), -1)
+    rms = np.sqrt(np.mean(np.square(sig), axis=0, dtype=np.float64))
+    peak = np.max(np.abs(sig), axis=0)
+    return rms, peak
+
+
+def measure_blocks(blocks):
+    """ Return per-channel RMS and peak values of a signal 
+        given as an iterable of float blocks, without 
+        holding the whole signal in memory
+    """
+    total = 0
+    sum_sq = 0
+    peak = 0
+    for block in blocks:
+        block = block.reshape(len(block), -1)
+        total += len(block)
+        sum_sq = sum_sq + np.sum(np.square(block), axis=0, dtype=np.float64)
+        peak = np.maximum(peak, np.max(np.abs(block), axis=0))
+    rms = np.sqrt(sum_sq / total)
+    return rms, peak
+
+
+def build_index(file_paths):
+    """ Add any missing or outdated files to their directory 
+        indexes and save the indexes to disk
+    """
+    indexes = dict()
+    for file_path in file_paths:
+        index = indexmodel.get_index(os.path.dirname(file_path) or '.')
+        indexes[index.directory] = index
+        if index.lookup(file_path) is not None:
+            continue
+        if os.stat(file_path).st_size >= Audio.mmap_bytes:
+            # Scan long files in the background
+            measure_async(file_path)
+            continue
+
+        fs, sig, data_type = cache.read(file_path)
+        rms, peak = measure(sig)
+        index.update(file_path, rms, peak)
+
+    for index in indexes.values():
+        index.save()
+
+
+# Background measurements of long files, by absolute path
+_measuring = dict()
+_measuring_lock = threading.Lock()
+
+
+def measure_async(file_path):
+    """ Measure a long (memory-mapped) file on a background 
+        thread and store its RMS and peak values in its 
+        directory index, so its first presentation doesn't 
+        scan the whole file on the GUI thread. Short files 
+        are quick to measure when read, and are skipped. 
+        Returns the thread, or None if nothing to measure.
+    """
+    try:
+        if os.stat(file_path).st_size < Audio.mmap_bytes:
+            return None
+    except OSError:
+        return None
+    index = indexmodel.get_index(os.path.dirname(file_path) or '.')
+    if index.lookup(file_path) is not None:
+        return None
+
+    key = os.path.abspath(file_path)
+    with _measuring_lock:
+        thread = _measuring.get(key)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=_measure_file,
+                args=(file_path, index), name='measure', daemon=True)
+            _measuring[key] = thread
+            thread.start()
+    return thread
+
+
+def wait_measured(file_path):
+    """ Wait for a background measurement of FILE_PATH 
+        (if any) to finish
+    """
+    with _measuring_lock:
+        thread = _measuring.pop(os.path.abspath(file_path), None)
+    if thread is not None:
+        thread.join()
+
+
+def _measure_file(file_path, index):
+    """ Scan a memory-mapped file and save its values to 
+        INDEX (runs on a background thread)
+    """
+    from scipy.io import wavfile
+    try:
+        fs, raw = wavfile.read(file_path, mmap=True)
+        rms, peak = measure_blocks(BlockSource(raw, raw.dtype).blocks())
+    except (OSError, EOFError, ValueError) as e:
+        # Measured when played instead
+        print(f"Models_audiomodel: Cannot measure {file_path}: {e}")
+        return
+    index.update(file_path, rms, peak)
+    index.save()
+    print("Models_audiomodel: Measured " +
+        f"{os.path.basename(file_path)} in the background")
@@ -8,6 +8,7 @@
 import csv
 from pathlib import Path
 from datetime import datetime
+from time import monotonic
 import os
 
 
@@ -16,20 +17,70 @@ import os
 #########
 class CSVModel:
     """ Write provided dictionary to .csv
+
+        The file is opened (and write access checked) with 
+        the first record of a session and kept open until 
+        close() is called. Rows are flushed to disk according 
+        to a policy:
+            FLUSH_ROWS: flush after this many rows (1 = every 
+                row; None = only by time or on close)
+            FLUSH_SECS: flush once this many seconds have passed
+                since the last flush, checked on each write and 
+                by flush_if_due() (None = off)
+            FSYNC: also ask the OS to write flushed rows to disk
     """
-    def __init__(self, sessionpars):
+    flush_rows = 1
+    flush_secs = None
+    fsync = False
+
+    def __init__(self, sessionpars, flush_rows=None, flush_secs=None, 
+        fsync=None):
         self.sessionpars = sessionpars
 
+        # Override default flush policy
+        if flush_rows is not None:
+            self.flush_rows = flush_rows
+        if flush_secs is not None:
+            self.flush_secs = flush_secs
+        if fsync is not None:
+            self.fsync = fsync
+
         # Generate date stamp
         self.datestamp = datetime.now().strftime("%Y_%b_%d_%H%M")
 
+        self.file = None
+        self._fh = None
+        self._writer = None
+        self._pending = 0
+        self._last_flush = monotonic()
 
-    def save_record(self, data):
-        """ Save a dictionary of data to .csv file 
+
+    def path(self):
+        """ Return the data file path for this session (set 
+            from the current subject and condition on first use)
+        """
+        if self.file is None:
+            # Create file name and path
+            filename = f"{self.sessionpars['Subject'].get()}_{self.sessionpars['Condition'].get()}_{self.datestamp}_.csv"
+            self.file = Path(filename)
+        return self.file
+
+
+    def saved_trials(self):
+        """ Return the set of trial numbers already in the 
+            data file (e.g., when resuming a session)
+        """
+        if not self.path().exists():
+            return set()
+        with open(self.file, 'r', newline='') as fh:
+            return {int(row['Trial']) for row in csv.DictReader(fh) 
+                if row.get('Trial')}
+
+
+    def open(self, fieldnames):
+        """ Check write access and open the file for appending
         """
-        # Create file name and path
-        filename = f"{self.sessionpars['Subject'].get()}_{self.sessionpars['Condition'].get()}_{self.datestamp}_.csv"
-        self.file = Path(filename)
+        filename = self.path()
 
         # Check for write access to store csv
         file_exists = os.access(self.file, os.F_OK)
@@ -42,11 +93,75 @@ class CSVModel:
             msg = f"Permission denied accessing file: {filename}"
             raise PermissionError(msg)
 
+        # Open file for the rest of the session
+        newfile = not file_exists or self.file.stat().st_size == 0
+        self._fh = open(self.file, 'a', newline='')
+        self._writer = csv.DictWriter(self._fh, fieldnames=fieldnames)
+        if newfile:
+            self._writer.writeheader()
+        elif not self._ends_with_newline():
+            # Last row was cut off (e.g., app closed mid-write)
+            self._fh.write('\r\n')
+        self._last_flush = monotonic()
+        print(f"Models_csvmodel: Opened {self.file} for writing")
+
+
+    def _ends_with_newline(self):
+        """ Check whether the existing file ends with a newline
+        """
+        with open(self.file, 'rb') as fh:
+            fh.seek(-1, os.SEEK_END)
+            return fh.read(1) == b'\n'
+
+
+    def save_record(self, data):
+        """ Save a dictionary of data to .csv file 
+        """
+        if self._fh is None:
+            self.open(list(data.keys()))
+
         # Write data to file
-        newfile = not self.file.exists()
-        with open(self.file, 'a', newline='') as fh:
-            csvwriter = csv.DictWriter(fh, fieldnames=data.keys())
-            if newfile:
-                csvwriter.writeheader()
-            csvwriter.writerow(data)
+        self._writer.writerow(data)
+        self._pending += 1
+        self.flush_if_due()
         print("Models_csvmodel_52:Record successfully saved!")
+
+
+    def flush_if_due(self):
+        """ Flush buffered rows if the flush policy says so
+        """
+        if not self._pending:
+            return
+        if (
+            (self.flush_rows and self._pending >= self.flush_rows) or
+            (self.flush_secs is not None and 
+                monotonic() - self._last_flush >= self.flush_secs)
+        ):
+            self.flush()
+
+
+    def flush(self):
+        """ Write buffered rows to disk
+        """
+        if self._fh is None:
+            return
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+        self._pending = 0
+        self._last_flush = monotonic()
+
+
+    def close(self):
+        """ Flush and close the file. A later record opens
+            it again.
+        """
+        if self._fh is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._fh.close()
+            self._fh = None
+            self._writer = None
+            print(f"Models_csvmodel: Closed {self.file}")
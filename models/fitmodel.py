@@ -0,0 +1,298 @@
+""" Model for fitting psychometric functions to per-level
+    scores, with bootstrap confidence intervals.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import math
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Import data science packages
+import numpy as np
+
+# scipy.optimize is imported when a function is first fitted
+
+
+#########
+# BEGIN #
+#########
+# Psychometric functions: F(z), dF/dz, z = slope * (level - threshold)
+#   logistic: F(threshold) = 0.5
+#   weibull: Weibull function of linear amplitude, written for
+#       levels in dB (a Gumbel function); F(threshold) = 0.632
+FUNCTIONS = ('logistic', 'weibull')
+
+# Largest lapse rate the fit may use
+MAX_LAPSE = 0.1
+
+# Default bootstrap settings
+N_BOOT = 2000
+SEED = 0
+CI = 95
+
+# Number of bootstrap samples sent to a worker at a time (fixed,
+# so results don't depend on the number of workers)
+CHUNK = 250
+
+# Keep probabilities away from 0 and 1 in log-likelihoods
+_EPS = 1e-9
+
+
+def _function(name, z):
+    """ Return F(z) and dF/dz
+    """
+    if name == 'logistic':
+        f = 1 / (1 + np.exp(-z))
+        return f, f * (1 - f)
+    if name == 'weibull':
+        ez = np.exp(np.minimum(z, 50))
+        f = -np.expm1(-ez)
+        return f, ez * (1 - f)
+    raise ValueError(f"Unknown psychometric function: {name}")
+
+
+def psi(params, levels, function='logistic', guess=0.0):
+    """ Proportion correct at LEVELS for PARAMS (threshold,
+        slope, lapse)
+    """
+    threshold, slope, lapse = params
+    f, _ = _function(function, slope * (np.asarray(levels) - threshold))
+    return guess + (1 - guess - lapse) * f
+
+
+def level_at(p, params, function='logistic', guess=0.0):
+    """ Level (dB) at which proportion correct is P. Returns
+        None if the function never reaches P.
+    """
+    threshold, slope, lapse = params
+    f = (p - guess) / (1 - guess - lapse)
+    if not 0 < f < 1 or slope <= 0:
+        return None
+    if function == 'logistic':
+        z = math.log(f / (1 - f))
+    else:
+        z = math.log(-math.log1p(-f))
+    return threshold + z / slope
+
+
+def _negloglik(flat, levels, correct, total, function, guess):
+    """ Negative binomial log-likelihood and its gradient for
+        one or more independent fits at once.
+
+        FLAT holds (threshold, slope, lapse) for each fit;
+        CORRECT has one row of scores per fit. The fits don't
+        share parameters, so minimizing the sum fits them all.
+    """
+    params = flat.reshape(-1, 3)
+    threshold, slope, lapse = (params[:, [ii]] for ii in range(3))
+    f, df = _function(function, slope * (levels - threshold))
+    scale = 1 - guess - lapse
+    p = np.clip(guess + scale * f, _EPS, 1 - _EPS)
+
+    ll = correct * np.log(p) + (total - correct) * np.log1p(-p)
+    dp = correct / p - (total - correct) / (1 - p)
+    grad = np.stack([
+        np.sum(dp * scale * df * -slope, axis=1),
+        np.sum(dp * scale * df * (levels - threshold), axis=1),
+        np.sum(dp * -f, axis=1)
+    ], axis=1)
+    return -np.sum(ll), -grad.ravel()
+
+
+def _start(levels, correct, total):
+    """ Starting values: threshold where scores cross the
+        middle of the observed range, and a slope spanning the
+        tested levels
+    """
+    span = max(np.ptp(levels), 1.0)
+    props = correct / np.maximum(total, 1)
+    weights = 1 - 2 * np.abs(props - 0.5) + 1e-3
+    threshold = float(np.sum(levels * weights) / np.sum(weights))
+    return np.array([threshold, 4 / span, 0.02])
+
+
+def _bounds(levels):
+    """ Parameter bounds: threshold within one range of the
+        tested levels, positive slope, small lapse rate
+    """
+    low, high = float(np.min(levels)), float(np.max(levels))
+    span = max(high - low, 1.0)
+    return [(low - span, high + span), (1e-3 / span, 50 / span),
+        (0.0, MAX_LAPSE)]
+
+
+def _minimize(levels, correct, total, function, guess, start):
+    """ Maximum-likelihood parameters for each row of CORRECT.
+        Returns an array of (threshold, slope, lapse) rows and
+        the total log-likelihood.
+    """
+    from scipy.optimize import minimize
+    correct = np.atleast_2d(correct)
+    count = len(correct)
+    result = minimize(_negloglik, np.tile(start, count), jac=True,
+        method='L-BFGS-B', bounds=_bounds(levels) * count,
+        args=(levels, correct, total, function, guess),
+        options={'maxiter': 5000, 'ftol': 1e-15, 'gtol': 1e-7})
+    return result.x.reshape(-1, 3), -result.fun
+
+
+def _as_arrays(levels, correct, total):
+    levels = np.asarray(levels, dtype=np.float64)
+    correct = np.asarray(correct, dtype=np.float64)
+    total = np.asarray(total, dtype=np.float64)
+    if not levels.shape == correct.shape == total.shape:
+        raise ValueError("Levels, correct and total must be the same length")
+    if np.any(correct > total) or np.any(correct < 0):
+        raise ValueError("Number correct must be between 0 and total")
+    # Levels with nothing scored add nothing to the likelihood
+    keep = total > 0
+    levels, correct, total = levels[keep], correct[keep], total[keep]
+    if len(np.unique(levels)) < 3:
+        raise ValueError("At least 3 presentation levels are needed to fit " +
+            "a psychometric function")
+    return levels, correct, total
+
+
+def fit(levels, correct, total, function='logistic', guess=0.0):
+    """ Fit a psychometric function by maximum likelihood.
+
+        LEVELS: presentation level (dB) of each group of trials
+        CORRECT: number correct at each level (sentences or
+            key words)
+        TOTAL: number scored at each level
+        GUESS: proportion correct by chance (0 for open-set
+            speech)
+
+        Returns a dictionary: function, guess, threshold (dB),
+        slope (per dB), lapse, srt (level for 50% correct; None if
+        not reached) and log-likelihood.
+    """
+    levels, correct, total = _as_arrays(levels, correct, total)
+    params, loglik = _minimize(levels, correct, total, function, guess,
+        _start(levels, correct, total))
+    return _result(params[0], function, guess, loglik=float(loglik))
+
+
+def _result(params, function, guess, **kwargs):
+    threshold, slope, lapse = (float(value) for value in params)
+    srt = level_at(0.5, (threshold, slope, lapse), function, guess)
+    return dict(function=function, guess=guess, threshold=threshold,
+        slope=slope, lapse=lapse, srt=srt, **kwargs)
+
+
+def _boot_chunk(seed, count, levels, correct, total, function, guess,
+    start):
+    """ Fit COUNT bootstrap samples (runs in a worker process).
+        Each level's score is redrawn from a binomial with the
+        observed proportion correct, and all samples are
+        fitted together. Returns an array of (threshold, 
+        slope, lapse, srt) rows.
+    """
+    rng = np.random.default_rng(seed)
+    samples = rng.binomial(total.astype(np.int64), correct / total,
+        size=(count, len(levels))).astype(np.float64)
+    params, _ = _minimize(levels, samples, total, function, guess, start)
+    srts = [level_at(0.5, row, function, guess) for row in params]
+    srts = np.array([np.nan if srt is None else srt for srt in srts])
+    return np.column_stack([params, srts])
+
+
+def bootstrap(levels, correct, total, result, n_boot=N_BOOT, seed=SEED,
+    ci=CI, workers=None, executor=None):
+    """ Percentile confidence intervals for a fit (RESULT from
+        fit) by nonparametric (binomial) bootstrap.
+
+        Samples are split into chunks of CHUNK, each with its
+        own random stream spawned from SEED, and fitted in a
+        process pool (EXECUTOR, or a new pool of WORKERS
+        processes; workers=1 fits in this process). The same
+        SEED always gives the same intervals.
+
+        Returns a dictionary of (low, high) for threshold,
+        slope, lapse and srt, plus n_boot and ci.
+    """
+    levels, correct, total = _as_arrays(levels, correct, total)
+    function, guess = result['function'], result['guess']
+    start = np.array([result['threshold'], result['slope'],
+        result['lapse']])
+
+    counts = [CHUNK] * (n_boot // CHUNK)
+    if n_boot % CHUNK:
+        counts.append(n_boot % CHUNK)
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    args = [(s, c, levels, correct, total, function, guess, start)
+        for s, c in zip(seeds, counts)]
+
+    if executor is not None:
+        chunks = list(executor.map(_boot_chunk, *zip(*args)))
+    elif workers == 1 or len(counts) == 1:
+        chunks = [_boot_chunk(*arg) for arg in args]
+    else:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunks = list(pool.map(_boot_chunk, *zip(*args)))
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Models_fitmodel: Process pool failed ({e}); " +
+                "fitting in this process")
+            chunks = [_boot_chunk(*arg) for arg in args]
+    samples = np.concatenate(chunks)
+
+    tail = (100 - ci) / 2
+    intervals = dict(n_boot=n_boot, ci=ci)
+    for ii, name in enumerate(('threshold', 'slope', 'lapse', 'srt')):
+        values = samples[:, ii]
+        values = values[np.isfinite(values)]
+        intervals[name] = tuple(float(v) for v in
+            np.percentile(values, [tail, 100 - tail])) if len(values) \
+            else (None, None)
+    return intervals
+
+
+def fit_with_ci(levels, correct, total, function='logistic', guess=0.0,
+    **kwargs):
+    """ Fit and bootstrap in one call (see fit and bootstrap).
+        Returns the fit dictionary with a 'ci' entry.
+    """
+    result = fit(levels, correct, total, function, guess)
+    result['ci'] = bootstrap(levels, correct, total, result, **kwargs)
+    return result
+
+
+def from_stats(stats, score='words'):
+    """ Return (levels, correct, total) from a RunningStats
+        object. SCORE is 'words' (key words) or 'sentences'.
+    """
+    rows = [row for row in stats.summary() if row['Level'] != 'All']
+    levels = [float(row['Level']) for row in rows]
+    if score == 'words':
+        return levels, [row['Words Correct'] for row in rows], \
+            [row['Words Total'] for row in rows]
+    return levels, [row['Sentences Correct'] for row in rows], \
+        [row['Trials'] for row in rows]
+
+
+def summary_text(result):
+    """ Return a fit (with confidence intervals) as lines of
+        text for display
+    """
+    ci = result.get('ci', {})
+    def fmt(name, unit=''):
+        value = result[name]
+        if value is None:
+            return 'not reached'
+        text = f"{value:.2f}{unit}"
+        low, high = ci.get(name, (None, None))
+        if low is not None:
+            text += f" [{low:.2f}, {high:.2f}]"
+        return text
+
+    lines = [f"{result['function'].capitalize()} fit" +
+        (f" ({ci['ci']}% CI, {ci['n_boot']} resamples)" if ci else ''),
+        f"50% correct: {fmt('srt', ' dB')}",
+        f"Threshold: {fmt('threshold', ' dB')}",
+        f"Slope: {fmt('slope', '/dB')}",
+        f"Lapse rate: {fmt('lapse')}"]
+    return '\n'.join(lines)
@@ -0,0 +1,249 @@
+""" Model for storing an index of audio files and their
+    statistics for each audio directory, so the directory
+    only needs to be scanned (and each file measured) when
+    something changes.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import os
+import json
+import wave
+import hashlib
+import threading
+from pathlib import Path
+
+
+#########
+# BEGIN #
+#########
+class AudioIndex:
+    """ On-disk index of the .wav files in a single directory.
+        Each file entry holds its number (from the file name),
+        size, modification time, sample rate, channels and
+        duration, plus RMS and peak values (per channel) once
+        measured.
+
+        The file listing is invalidated by the directory's
+        modification time, and RMS/peak values by each file's
+        modification time and size. Files that can't be read
+        as .wav files are left out of the index and listed in
+        self.unreadable (file name: reason). The index is 
+        stored as a JSON file in a per-user cache, named by
+        the directory's absolute path. Saving it then doesn't
+        change the directory's modification time, and works
+        for read-only corpus shares.
+    """
+    # Index files, named by a hash of the directory path
+    cache_dir = Path.home() / '.speech_task_cache' / 'index'
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        name = hashlib.sha1(self.directory.encode('utf-8')).hexdigest()
+        self.filepath = self.cache_dir / f"{name}.json"
+        self.dir_mtime = None
+        self.files = dict()
+        self.numbers = dict()
+        self.unreadable = dict()
+        self.dirty = False
+        self._lock = threading.Lock()
+
+        # Load existing index file
+        self.load()
+
+
+    def load(self):
+        """ Load index from file
+        """
+        if not self.filepath.exists():
+            return
+
+        try:
+            with open(self.filepath, 'r') as fh:
+                raw_values = json.load(fh)
+        except (OSError, ValueError):
+            print("Models_indexmodel: Could not read index file - rebuilding")
+            return
+        if raw_values.get('directory') != self.directory:
+            return
+
+        self.dir_mtime = raw_values.get('dir_mtime')
+        self.files = raw_values.get('files', dict())
+        self.unreadable = raw_values.get('unreadable', dict())
+        self._map_numbers()
+
+
+    def save(self):
+        """ Write index to file if anything has changed. Written
+            to a temporary file first so a partial write never
+            corrupts the index.
+        """
+        with self._lock:
+            if not self.dirty:
+                return
+            data = {'directory': self.directory, 'dir_mtime': self.dir_mtime,
+                'files': dict(self.files), 'unreadable': dict(self.unreadable)}
+            self.dirty = False
+
+        temp = self.filepath.with_suffix('.tmp')
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(temp, 'w') as fh:
+                json.dump(data, fh)
+            os.replace(temp, self.filepath)
+            print("Models_indexmodel: Saved audio index")
+        except OSError:
+            # The in-memory index is still used this session
+            print("Models_indexmodel: Could not write audio index!")
+
+
+    def scan(self):
+        """ Update the file listing if the directory has 
+            changed since the last scan. Raises 
+            FileNotFoundError if the directory doesn't exist.
+        """
+        dir_mtime = os.stat(self.directory).st_mtime_ns
+        if dir_mtime == self.dir_mtime:
+            return
+
+        print("Models_indexmodel: Audio directory changed - rescanning")
+        files = dict()
+        unreadable = dict()
+        with os.scandir(self.directory) as entries:
+            for item in entries:
+                if not item.name.lower().endswith('.wav'):
+                    continue
+                st = item.stat()
+                entry = self.files.get(item.name)
+                if (
+                    entry is None or
+                    'fs' not in entry or
+                    entry['mtime'] != st.st_mtime_ns or
+                    entry['size'] != st.st_size
+                ):
+                    try:
+                        entry = self._describe(item.path, st)
+                    except (OSError, EOFError, ValueError, wave.Error) as e:
+                        # One bad file shouldn't stop the rest loading
+                        print("Models_indexmodel: Cannot read " +
+                            f"{item.name}: {e}")
+                        unreadable[item.name] = str(e)
+                        continue
+                files[item.name] = entry
+
+        with self._lock:
+            changed = (files != self.files or unreadable != self.unreadable)
+            self.files = files
+            self.unreadable = unreadable
+            self.dir_mtime = dir_mtime
+            self._map_numbers()
+            if changed:
+                self.dirty = True
+
+
+    def path(self, file_num):
+        """ Return the full path for a file number, or None 
+        """
+        name = self.numbers.get(file_num)
+        if name is None:
+            return None
+        return os.path.join(self.directory, name)
+
+
+    def lookup(self, file_path):
+        """ Return the stored entry for file_path, or None if
+            missing, not yet measured, or out of date
+        """
+        name = os.path.basename(file_path)
+        entry = self.files.get(name)
+        if entry is None or 'rms' not in entry:
+            return None
+
+        st = os.stat(file_path)
+        if entry['mtime'] != st.st_mtime_ns or entry['size'] != st.st_size:
+            return None
+        return entry
+
+
+    def update(self, file_path, rms, peak):
+        """ Store per-channel RMS and peak values for file_path
+        """
+        name = os.path.basename(file_path)
+        st = os.stat(file_path)
+        entry = self.files.get(name)
+        if (
+            entry is None or 
+            entry['mtime'] != st.st_mtime_ns or
+            entry['size'] != st.st_size
+        ):
+            entry = self._describe(file_path, st)
+        entry = dict(entry, 
+            rms=[float(x) for x in rms], 
+            peak=[float(x) for x in peak])
+
+        with self._lock:
+            self.files[name] = entry
+            self._map_numbers()
+            self.dirty = True
+
+
+    def _map_numbers(self):
+        """ Map file numbers to file names 
+        """
+        self.numbers = {entry['num']: name 
+            for name, entry in self.files.items() 
+            if entry.get('num') is not None}
+
+
+    @staticmethod
+    def _describe(file_path, st):
+        """ Create an index entry from a file's header
+        """
+        name = os.path.basename(file_path)
+        try:
+            num = int(name[:-4])
+        except ValueError:
+            # Only numbered files are used as stimuli
+            num = None
+
+        entry = {'num': num, 'mtime': st.st_mtime_ns, 'size': st.st_size}
+        entry.update(read_header(file_path))
+        return entry
+
+
+# One index per audio directory
+_indexes = dict()
+_indexes_lock = threading.Lock()
+
+def get_index(directory):
+    """ Return the shared AudioIndex for directory
+    """
+    directory = os.path.abspath(directory)
+    with _indexes_lock:
+        if directory not in _indexes:
+            _indexes[directory] = AudioIndex(directory)
+        return _indexes[directory]
+
+
+def read_header(file_path):
+    """ Return sample rate, channels and duration of a .wav 
+        file without reading its audio data
+    """
+    try:
+        with wave.open(file_path, 'rb') as fh:
+            fs = fh.getframerate()
+            channels = fh.getnchannels()
+            frames = fh.getnframes()
+    except (wave.Error, EOFError):
+        # e.g., floating point files: map rather than read
+        from scipy.io import wavfile
+        try:
+            fs, data = wavfile.read(file_path, mmap=True)
+        except ValueError:
+            fs, data = wavfile.read(file_path)
+        channels = 1 if data.ndim == 1 else data.shape[1]
+        frames = len(data)
+        del data
+    return {'fs': fs, 'channels': channels, 'dur': frames / fs}
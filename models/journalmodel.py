@@ -0,0 +1,140 @@
+""" Model for an append-only session journal, used to
+    resume a session after a crash.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import os
+import json
+import threading
+from pathlib import Path
+
+# Import data science packages
+import numpy as np
+
+
+#########
+# BEGIN #
+#########
+class Journal:
+    """ Append-only journal (one JSON object per line) written
+        next to the data .csv file.
+
+        The first line describes the session: data file,
+        session parameters, random seed, trial order and the
+        full trial table (sentences, words, key words, audio
+        paths and levels), so a session can be rebuilt without
+        reading the sentence file or audio directory. Each
+        following line is one scored trial (the same values
+        written to the .csv file).
+
+        Every line is flushed as soon as it is written. Set
+        FSYNC to also force it to disk.
+
+        Used as a RecordWriter sink (save_record, flush_if_due
+        and close).
+    """
+    suffix = '.jsonl'
+    fsync = False
+
+    def __init__(self):
+        self.file = None
+        self._fh = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def is_open(self):
+        return self._fh is not None
+
+
+    def begin(self, data_file, header):
+        """ Start a new journal for DATA_FILE with the session
+            HEADER (a dictionary)
+        """
+        self.file = Path(data_file).with_suffix(self.suffix)
+        header = dict(header, type='session', data_file=str(
+            Path(data_file).resolve()))
+        with self._lock:
+            self._fh = open(self.file, 'w', encoding='utf-8')
+            self._write(header)
+        print(f"Models_journalmodel: Started journal {self.file}")
+
+
+    def resume(self, file_path):
+        """ Reopen an existing journal to append more trials
+        """
+        self.file = Path(file_path)
+        with self._lock:
+            self._fh = open(self.file, 'a', encoding='utf-8')
+        print(f"Models_journalmodel: Resumed journal {self.file}")
+
+
+    def save_record(self, data):
+        """ Append one trial record
+        """
+        with self._lock:
+            if self._fh is None:
+                return
+            self._write({'type': 'trial', 'data': data})
+
+
+    def flush_if_due(self):
+        """ Lines are flushed as they are written
+        """
+        pass
+
+
+    def close(self):
+        """ Close the journal file
+        """
+        with self._lock:
+            if self._fh is None:
+                return
+            self._fh.close()
+            self._fh = None
+
+
+    def _write(self, entry):
+        """ Write one line (call with lock held)
+        """
+        self._fh.write(json.dumps(entry, default=_to_builtin) + '\n')
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+
+
+def load(file_path):
+    """ Read a journal. Returns (header, list of trial records).
+        Reading stops at an incomplete last line (e.g., if the
+        app closed while writing it).
+    """
+    header = None
+    records = []
+    with open(file_path, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                print("Models_journalmodel: Skipping incomplete journal line")
+                break
+            if entry.get('type') == 'session':
+                header = entry
+            elif entry.get('type') == 'trial':
+                records.append(entry['data'])
+
+    if header is None:
+        raise ValueError("Not a session journal: no session header found")
+    return header, records
+
+
+def _to_builtin(value):
+    """ Convert NumPy values for JSON
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Cannot write {type(value).__name__} to journal")
@@ -0,0 +1,47 @@
+""" Model for converting presentation levels (dB) into raw
+    levels (dB FS) and linear gains.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+
+#########
+# BEGIN #
+#########
+class LevelTable:
+    """ Lookup table of raw level (dB FS) and linear gain for
+        each distinct presentation level in a session. Built
+        once at the start of a session from the calibration
+        values, so trials only need a dictionary lookup.
+
+        SLM offset = SLM calibration value - calibration raw level
+        Raw level = presentation level - SLM offset
+        Gain = linear amplitude of the raw level (target RMS
+            re: full scale)
+    """
+    def __init__(self, levels, slm_cal_value, raw_lvl):
+        self.offset = float(slm_cal_value) - float(raw_lvl)
+        self.levels = np.unique(np.asarray(levels, dtype=np.float64))
+        self.raw_levels = self.levels - self.offset
+        self.gains = 10 ** (self.raw_levels / 20)
+        self._table = {
+            float(db): (float(raw), float(gain))
+            for db, raw, gain in zip(self.levels, self.raw_levels, self.gains)
+        }
+        print(f"Models_levelmodel: SLM offset: {self.offset}")
+        print("Models_levelmodel: Level table (dB: raw dB FS): " +
+            f"{ {db: raw for db, (raw, _) in self._table.items()} }")
+
+
+    def __getitem__(self, level):
+        """ Return (raw level, linear gain) for a presentation level
+        """
+        return self._table[float(level)]
+
+
+    def __len__(self):
+        return len(self._table)
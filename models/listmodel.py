@@ -11,11 +11,18 @@ from tkinter import messagebox
 
 # Import data science packages
 import numpy as np
-import pandas as pd
+# pandas is imported when stimuli are first loaded
 
 # Import system packages
 import os
+import hashlib
 from glob import glob
+from itertools import chain
+from pathlib import Path
+
+# Import custom modules
+from models import audiomodel as a
+from models import indexmodel
 
 
 #########
@@ -30,6 +37,22 @@ class StimulusList:
             self.sentence_df: data frame of sentences, indexes
     """
 
+    # Parsed copies of sentence files, keyed by file hash
+    cache_dir = Path.home() / '.speech_task_cache'
+    # Change when the cached columns change, so older cache 
+    # files are ignored (and removed)
+    cache_version = 2
+    # Most recent parsed sentence files kept on disk
+    cache_files = 8
+    # Rows parsed per chunk when reading a sentence file
+    chunksize = 50000
+
+    # Parsed sentence files already loaded this session, keyed 
+    # by file hash
+    _parsed = dict()
+    # File hashes by (path, mtime, size)
+    _hashes = dict()
+
     def __init__(self, sessionpars):
         # Initialize
         self.sessionpars = sessionpars
@@ -46,13 +69,14 @@ class StimulusList:
             # Load and subset sentences
             # Must occur before audio call
             self._get_sentences()
-            # Load and subset audio files based on sentence df length
+            # Load audio file paths from the audio directory index
             self._get_audio_files()
-            # Create list of presentation levels based on sentence 
-            #   df length and sentences_per_list
+            # Create presentation level for each list
             self._get_levels()
             # Create master df of sentences, audio and levels
             self._make_master_df()
+            # Store RMS/peak values for any new audio files
+            self._index_audio_files()
         except FileNotFoundError:
             print("Models_Listmodel_52: Cannot find stimuli!")
 
@@ -90,8 +114,8 @@ class StimulusList:
                 title="Too Many Files!",
                 message="Multiple sentence files found - grabbing one at random."
             )
-        # Read sentence file into dataframe
-        s = pd.read_csv(sentence_file[0])
+        # Read sentences for the specified lists into dataframe
+        s = self._read_sentences(sentence_file[0])
         s = s.groupby('list_num').head(self.sessionpars['sentences_per_list'].get()).reset_index(drop=True)
 
         # Get sentences for specified list numbers
@@ -100,12 +124,150 @@ class StimulusList:
         print("Models_listmodel_91: Sentence list dataframe loaded into listmodel")
 
 
+    def _read_sentences(self, sentence_file):
+        """ Return rows of the sentence file that belong to the 
+            specified lists.
+
+            The whole file is parsed and tokenized in chunks 
+            once, and cached on disk (keyed by a hash of the 
+            file's contents and the cache version) and in 
+            memory. Rows are filtered to the specified lists 
+            after loading, so any list combination uses the 
+            same cache file.
+        """
+        import pandas as pd
+        digest = self._hash_file(sentence_file)
+        cache_file = self.cache_dir / \
+            f"sentences_v{self.cache_version}_{digest}.pkl"
+
+        # In memory (loaded this session)
+        cached = self._parsed.get(digest)
+
+        # On disk
+        if cached is None and cache_file.exists():
+            try:
+                cached = pd.read_pickle(cache_file)
+                # Mark as recently used (see _clean_cache)
+                os.utime(cache_file)
+                print("Models_listmodel: Loaded cached sentence file")
+            except Exception:
+                print("Models_listmodel: Could not read cached sentence file")
+
+        if cached is None:
+            cached = self._parse_sentences(sentence_file)
+            # Store parsed rows for next time
+            try:
+                self.cache_dir.mkdir(exist_ok=True)
+                temp = cache_file.with_suffix('.tmp')
+                pd.to_pickle(cached, temp)
+                os.replace(temp, cache_file)
+                self._clean_cache(cache_file)
+            except OSError:
+                print("Models_listmodel: Could not cache sentence file!")
+
+        self._parsed[digest] = cached
+        rows, self.corpus_nums = cached
+        return rows.loc[rows['list_num'].isin(self.lists)]
+
+
+    def _parse_sentences(self, sentence_file):
+        """ Parse and tokenize a sentence file in chunks. 
+            Returns (rows, all sentence numbers).
+        """
+        import pandas as pd
+        reader = pd.read_csv(sentence_file, 
+            usecols=['sentence', 'list_num', 'sentence_num'],
+            chunksize=self.chunksize)
+        parsed = []
+        for chunk in reader:
+            if not chunk.empty:
+                parsed.append(self._tokenize(chunk))
+
+        if parsed:
+            rows = pd.concat(parsed, ignore_index=True)
+        else:
+            rows = pd.DataFrame(columns=['sentence', 'list_num', 
+                'sentence_num', 'words', 'keywords'])
+        # All sentence numbers (to report unmatched audio files)
+        corpus_nums = rows['sentence_num'].to_numpy()
+        return rows, corpus_nums
+
+
+    def _clean_cache(self, keep):
+        """ Remove parsed sentence files from older cache 
+            versions, and all but the most recent cache_files
+        """
+        prefix = f"sentences_v{self.cache_version}_"
+        current = []
+        for path in self.cache_dir.glob('*.pkl'):
+            if path == keep:
+                continue
+            if path.name.startswith(prefix):
+                current.append(path)
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+        current.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+        for path in current[self.cache_files - 1:]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+    @staticmethod
+    def _tokenize(parsed):
+        """ Add a list of words (final period removed) and a 
+            tuple of key word positions (capitalized words, 
+            except 'A') for every sentence, vectorized over 
+            the whole file.
+        """
+        import pandas as pd
+        parsed = parsed.copy()
+        sentences = parsed['sentence'].astype(str).str.strip()
+        parsed['words'] = sentences.str.replace(r'\.$', '', 
+            regex=True).str.split()
+
+        # One entry per word across the whole file
+        counts = parsed['words'].str.len().to_numpy()
+        tokens = pd.Series(list(chain.from_iterable(parsed['words'])), 
+            dtype=object)
+        sentence = np.repeat(np.arange(len(counts)), counts)
+        position = np.arange(len(tokens)) \
+            - np.repeat(np.cumsum(counts) - counts, counts)
+        is_key = (tokens.str.isupper() & (tokens != 'A')).to_numpy(bool)
+
+        # Split key word positions back into sentences
+        num_keys = np.bincount(sentence[is_key], minlength=len(counts))
+        keywords = np.split(position[is_key], np.cumsum(num_keys)[:-1])
+        parsed['keywords'] = [tuple(kw.tolist()) for kw in keywords]
+        return parsed
+
+
+    def _hash_file(self, file_path):
+        """ Return SHA-1 of file contents. Only rehashed if 
+            the file's path, mtime or size changes.
+        """
+        st = os.stat(file_path)
+        key = (os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
+        if key not in self._hashes:
+            sha = hashlib.sha1()
+            with open(file_path, 'rb') as fh:
+                for block in iter(lambda: fh.read(1024*1024), b''):
+                    sha.update(block)
+            self._hashes[key] = sha.hexdigest()
+        return self._hashes[key]
+
+
     ###############
     # Audio Files #
     ###############
     def _get_audio_files(self):
-        """ Load in files as full paths. Select files based 
-            on sentences data frame.
+        """ Look up numbered files as full paths in the audio 
+            directory index.
         """
         # Check whether audio directory exists
         print("\nModels_listmodel_102: Checking for audio files dir...")
@@ -116,35 +278,48 @@ class StimulusList:
                 message="Cannot find the audio file directory!\n" +
                 "Please choose another file path."
             )
+            raise FileNotFoundError
 
-        # If a valid directory has been given, 
-        # get the audio file paths and names
-        glob_pattern = os.path.join(self.sessionpars['Audio Files Path'].get(), '*.wav')
-        # Create audio paths dataframe
-        self.audio_df = pd.DataFrame(glob(glob_pattern), columns=['path'])
-        # Create new column based on file names (which are numbered)
-        self.audio_df['file_num'] = self.audio_df['path'].apply(lambda x: x.split(os.sep)[-1][:-4])
-        # Convert to integers
-        self.audio_df['file_num'] = self.audio_df['file_num'].astype(int)
-        # Sort ascending by new column of integers
-        self.audio_df = self.audio_df.sort_values(by=['file_num'])
-
-        # Subset based on sentence dataframe values
-        self.audio_df = self.audio_df.loc[self.audio_df['file_num'].isin(self.sentence_df['sentence_num'])]
+        # If a valid directory has been given, get the audio 
+        # directory index (only rescanned if the directory changed)
+        index = indexmodel.get_index(self.sessionpars['Audio Files Path'].get())
+        index.scan()
+        # Files that aren't valid .wav files are left out
+        self.unreadable_files = sorted(index.unreadable)
+
+        # Create audio paths dataframe (sorted by file number)
+        import pandas as pd
+        file_nums = sorted(index.numbers)
+        self.audio_df = pd.DataFrame({
+            'path': [index.path(num) for num in file_nums],
+            'file_num': file_nums
+        })
         #print(self.audio_df)
         print("Models_listmodel_126: Audio list dataframe loaded into listmodel")
 
 
+    def _index_audio_files(self):
+        """ Add selected audio files to the audio directory 
+            index, so levels can be set without rescanning 
+            the audio on every presentation.
+        """
+        a.build_index(list(self.stim_master['audio']))
+        print("Models_listmodel: Audio directory index is up to date")
+
+
     ##########
     # Levels #
     ##########
     def _get_levels(self):
+        """ Map each list number to its presentation level. 
+            A single level applies to every list. Otherwise 
+            levels pair with lists in the order entered.
+        """
         if len(self.levels) == 1:
-            self.all_levels = np.repeat(self.levels, self.sentence_df.shape[0])
+            self.list_levels = {num: self.levels[0] for num in self.lists}
         else:
-            # create enough levels for each list
-            self.all_levels = np.repeat(self.levels, self.sessionpars['sentences_per_list'].get())
-        #print(f"\nPresentation levels: {self.all_levels}")
+            self.list_levels = dict(zip(self.lists, self.levels))
+        #print(f"\nPresentation levels: {self.list_levels}")
         print("\nModels_listmodel: Created list of presentation levels")
 
 
@@ -152,19 +327,61 @@ class StimulusList:
     # Create Master DF #
     ####################
     def _make_master_df(self):
-        self.stim_master = self.sentence_df.copy()
-        self.stim_master.drop('index', axis=1, inplace=True)
-        self.stim_master['audio'] = list(self.audio_df['path'])
-        self.stim_master['level'] = self.all_levels
+        """ Join sentences to audio files (sentence_num to 
+            file_num) and to levels (list_num) by key. Sentences 
+            without an audio file are dropped and reported, 
+            along with audio files that match no sentence.
+        """
+        self.stim_master = self.sentence_df.drop('index', axis=1)
+
+        # Hashed join of audio paths on sentence number
+        merged = self.stim_master.merge(self.audio_df, how='left',
+            left_on='sentence_num', right_on='file_num', validate='m:1')
+        merged = merged.rename(columns={'path': 'audio'})
+        merged['level'] = merged['list_num'].map(self.list_levels)
+
+        # Report missing and extra audio files
+        found = merged['audio'].notna()
+        self.missing_files = list(merged.loc[~found, 'sentence_num'])
+        extra = ~self.audio_df['file_num'].isin(self.corpus_nums)
+        self.extra_files = list(self.audio_df.loc[extra, 'path'])
+        self._report_files()
         
         # Reorder df column order
-        self.stim_master = self.stim_master[list((
-            'list_num', 'sentence_num', 'level', 'sentence', 'audio'
-        ))]
+        self.stim_master = merged.loc[found, [
+            'list_num', 'sentence_num', 'level', 'sentence', 'audio',
+            'words', 'keywords'
+        ]].reset_index(drop=True)
 
         # Convert str to float
-        self.stim_master.level.astype(float)
+        self.stim_master['level'] = self.stim_master['level'].astype(float)
         print("\nModels_listmodel: Created master stimulus dataframe")
         print(self.stim_master)
 
 
+    def _report_files(self):
+        """ Display missing and extra audio files
+        """
+        if self.extra_files:
+            print(f"Models_listmodel: {len(self.extra_files)} audio " +
+                "file(s) do not match any sentence")
+
+        if self.unreadable_files:
+            print(f"Models_listmodel: {len(self.unreadable_files)} audio " +
+                "file(s) could not be read and were skipped: " +
+                f"{', '.join(self.unreadable_files)}")
+
+        if not self.missing_files:
+            return
+
+        print("Models_listmodel: Missing audio for sentence(s): " +
+            f"{self.missing_files}")
+        shown = ', '.join(str(num) for num in self.missing_files[:20])
+        if len(self.missing_files) > 20:
+            shown += ', ...'
+        messagebox.showwarning(
+            title="Missing Audio Files!",
+            message=f"No audio file found for {len(self.missing_files)} " +
+                "sentence(s). These sentences will be skipped.",
+            detail=f"Sentence numbers: {shown}"
+        )
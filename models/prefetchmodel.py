@@ -0,0 +1,85 @@
+""" Model for preparing the next trial's audio in the background.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+from concurrent.futures import ThreadPoolExecutor
+
+# Import custom modules
+from models import audiomodel as a
+
+
+#########
+# BEGIN #
+#########
+class Prefetcher:
+    """ Load, decode and level an upcoming audio file on a
+        worker thread, so it is ready to present as soon
+        as it is requested.
+
+        Only one upcoming trial is held at a time. A
+        prefetched object is only handed over if the file
+        path and level still match the request.
+    """
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1,
+            thread_name_prefix='prefetch')
+        self._key = None
+        self._future = None
+
+
+    def submit(self, trial, file_path, level, gain=None):
+        """ Start preparing audio for the given trial. LEVEL
+            and GAIN are passed to Audio.
+        """
+        key = (trial, file_path, level)
+        if key == self._key:
+            # Already pending
+            return
+
+        if self._future is not None:
+            self._future.cancel()
+        self._key = key
+        self._future = self._executor.submit(self._prepare, file_path, 
+            level, gain)
+
+
+    def take(self, trial, file_path, level):
+        """ Return the prepared Audio object for the given
+            trial, or None if nothing matching was prefetched
+            (or loading it failed).
+        """
+        key, future = self._key, self._future
+        self._key = None
+        self._future = None
+
+        if future is None or key != (trial, file_path, level):
+            if future is not None:
+                future.cancel()
+            return None
+
+        try:
+            return future.result()
+        except Exception as e:
+            # Let the caller reload and handle errors on the main thread
+            print(f"Models_prefetchmodel: Prefetch failed: {e}")
+            return None
+
+
+    def shutdown(self):
+        """ Stop the worker thread
+        """
+        if self._future is not None:
+            self._future.cancel()
+        self._executor.shutdown(wait=False)
+
+
+    @staticmethod
+    def _prepare(file_path, level, gain):
+        """ Read and level audio (runs on worker thread)
+        """
+        audio = a.Audio(file_path, level, gain)
+        audio.set_level()
+        return audio
@@ -0,0 +1,200 @@
+""" Model for generating reproducible (seeded) trial orders,
+    with optional constraints.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import secrets
+
+
+#########
+# BEGIN #
+#########
+class Randomizer:
+    """ Generate trial orders (permutations of trial row
+        numbers) from a recorded seed using NumPy's Generator.
+        The same seed and settings always give the same order.
+
+        Constraints:
+            'None': plain shuffle
+            'Max Level Run': no more than MAX_RUN trials in a
+                row at the same level
+            'Blocked By List': trials from each list stay
+                together; list order and the order within each
+                list are shuffled
+            'Latin Square': like 'Blocked By List', but the
+                list order is a row of a balanced (Williams)
+                Latin square chosen by SESSION number, so list
+                order is counterbalanced across sessions
+    """
+    constraints = ('None', 'Max Level Run', 'Blocked By List', 'Latin Square')
+
+    def __init__(self, seed=None):
+        if seed is None or str(seed).strip() == '':
+            seed = secrets.randbelow(2**32)
+        self.seed = int(seed)
+        self.rng = np.random.default_rng(self.seed)
+
+
+    def order(self, constraint, levels, blocks, max_run=3, session=1):
+        """ Return a single trial order
+        """
+        return self.orders(1, constraint, levels, blocks, max_run,
+            session)[0]
+
+
+    def orders(self, count, constraint, levels, blocks, max_run=3,
+        session=1):
+        """ Return COUNT trial orders (count x trials array).
+
+            LEVELS: presentation level of each trial
+            BLOCKS: list number of each trial
+            SESSION: first session number (Latin Square). Row
+                i of the result is for session SESSION + i.
+        """
+        levels = np.asarray(levels)
+        blocks = np.asarray(blocks)
+        n = len(levels)
+
+        if constraint == 'None':
+            return np.argsort(self.rng.random((count, n)), axis=1)
+        elif constraint == 'Max Level Run':
+            return self._max_run(count, levels, int(max_run))
+        elif constraint == 'Blocked By List':
+            codes = np.unique(blocks, return_inverse=True)[1].reshape(-1)
+            num_blocks = codes.max() + 1
+            ranks = np.argsort(self.rng.random((count, num_blocks)), axis=1)
+            return self._blocked(ranks, codes)
+        elif constraint == 'Latin Square':
+            codes = np.unique(blocks, return_inverse=True)[1].reshape(-1)
+            square = williams(codes.max() + 1)
+            rows = (int(session) - 1 + np.arange(count)) % len(square)
+            # Rank of each block = its position in the square's row
+            ranks = np.argsort(square[rows], axis=1)
+            return self._blocked(ranks, codes)
+        else:
+            raise ValueError(f"Unknown constraint: {constraint}")
+
+
+    def _blocked(self, ranks, codes):
+        """ Order trials by block rank, shuffled within block
+        """
+        keys = ranks[:, codes] + self.rng.random((len(ranks), len(codes)))
+        return np.argsort(keys, axis=1)
+
+
+    def _max_run(self, count, levels, max_run, batches=20):
+        """ Orders with no more than MAX_RUN consecutive trials
+            at the same level. Whole batches of shuffles are
+            generated and checked at once; a constructive
+            method fills in when too few pass (tight constraints).
+        """
+        codes = np.unique(levels, return_inverse=True)[1].reshape(-1)
+        n = len(codes)
+        if max_run < 1:
+            raise ValueError("Max level run must be at least 1")
+        if max_run >= n:
+            return np.argsort(self.rng.random((count, n)), axis=1)
+
+        found = []
+        total = 0
+        size = max(2 * count, 64)
+        for batch_num in range(1, batches + 1):
+            batch = np.argsort(self.rng.random((size, n)), axis=1)
+            valid = batch[max_runs(codes[batch]) <= max_run]
+            found.append(valid)
+            total += len(valid)
+            if total >= count:
+                return np.concatenate(found)[:count]
+            # Stop early if the pass rate is too low to finish
+            if total / batch_num * batches < count:
+                break
+
+        found = list(np.concatenate(found))
+        while len(found) < count:
+            found.append(self._construct(codes, max_run))
+        return np.array(found[:count])
+
+
+    def _construct(self, codes, max_run, attempts=1000):
+        """ Build one order level by level, never choosing a
+            level that has reached MAX_RUN. Restarts on a dead end.
+        """
+        counts = np.bincount(codes).tolist()
+        levels = range(len(counts))
+        n = len(codes)
+        for _ in range(attempts):
+            remaining = list(counts)
+            draws = self.rng.random(n).tolist()
+            sequence = []
+            last = -1
+            run = 0
+            for draw in draws:
+                blocked = last if run >= max_run else -1
+                total = sum(remaining)
+                if blocked >= 0:
+                    total -= remaining[blocked]
+                if total == 0:
+                    break
+                # Choose a level in proportion to trials remaining
+                target = draw * total
+                for pick in levels:
+                    if pick == blocked or not remaining[pick]:
+                        continue
+                    target -= remaining[pick]
+                    if target < 0:
+                        break
+                remaining[pick] -= 1
+                run = run + 1 if pick == last else 1
+                last = pick
+                sequence.append(pick)
+            else:
+                # Assign shuffled trials of each level to its slots
+                sequence = np.array(sequence)
+                order = np.empty(n, dtype=np.intp)
+                for code in levels:
+                    trials = np.flatnonzero(codes == code)
+                    order[sequence == code] = self.rng.permutation(trials)
+                return order
+        raise ValueError("Cannot meet the max level run constraint!")
+
+
+def max_runs(codes):
+    """ Longest run of equal values in each row of CODES
+    """
+    codes = np.atleast_2d(codes)
+    rows, n = codes.shape
+    if n == 0:
+        return np.zeros(rows, dtype=int)
+    # Carry forward the position where each run started
+    idx = np.arange(n)
+    start = np.zeros((rows, n), dtype=int)
+    start[:, 1:] = np.where(codes[:, 1:] != codes[:, :-1], idx[1:], 0)
+    start = np.maximum.accumulate(start, axis=1)
+    return (idx - start + 1).max(axis=1)
+
+
+def williams(n):
+    """ Balanced Latin square (Williams design) for N
+        conditions. Each condition follows every other
+        equally often. Odd N gives 2N rows (each row is
+        followed by its reverse).
+    """
+    first = [0]
+    low, high = 1, n - 1
+    for i in range(1, n):
+        if i % 2:
+            first.append(low)
+            low += 1
+        else:
+            first.append(high)
+            high -= 1
+    square = (np.array(first) + np.arange(n)[:, np.newaxis]) % n
+    if n % 2:
+        square = np.vstack([square, square[:, ::-1]])
+    return square
@@ -0,0 +1,203 @@
+""" Model for running a session's trials without a GUI.
+"""
+
+###########
+# Imports #
+###########
+# Import custom modules
+from models import audiomodel as a
+from models import levelmodel as l
+from models import randommodel as r
+
+
+#########
+# BEGIN #
+#########
+class TrialRunner:
+    """ Owns the trial sequence of a session: trial counter,
+        presentation levels, audio presentation, scoring and
+        result emission. Has no Tk dependencies, so sessions
+        can be scripted, simulated and profiled headless
+        (see simulate.py); MainFrame drives it from the GUI.
+
+        TRIALS: TrialSequence
+        CRITERION: number of key words correct for a sentence
+            to be scored correct
+        PLAYER: audiomodel.Player (or NullPlayer)
+        PREFETCHER: optional prefetchmodel.Prefetcher, used to
+            load the next trial's audio during scoring
+        ON_RESULT: called with each scored trial's result
+            dictionary (ScoreModel field names)
+
+        Typical use:
+            runner.randomize(...)       # optional
+            runner.start(slm_cal_value, raw_lvl)
+            while True:
+                runner.present(device_id, channels)
+                runner.score(correct_positions)
+                if not runner.advance():
+                    break
+    """
+    def __init__(self, trials, criterion, player=None, prefetcher=None,
+        on_result=None):
+        self.trials = trials
+        self.criterion = criterion
+        self.player = player
+        self.prefetcher = prefetcher
+        self.on_result = on_result
+        self.counter = 0
+        self.levels = None
+        self.seed = ''
+        self._trial = None
+
+
+    @property
+    def trial(self):
+        """ Current trial (built once per trial) """
+        if self._trial is None:
+            self._trial = self.trials[self.counter]
+        return self._trial
+
+
+    @property
+    def trial_num(self):
+        """ Current trial number (from 1) """
+        return self.counter + 1
+
+
+    @property
+    def is_last(self):
+        """ True if the current trial is the last one """
+        return self.counter >= len(self.trials) - 1
+
+
+    def randomize(self, seed, constraint, max_run=3, session=1):
+        """ Reorder trials with a (recorded) seed and constraint.
+            A blank seed draws a new one. Returns the seed
+            used. Raises ValueError if no order meets the
+            constraint.
+        """
+        randomizer = r.Randomizer(seed)
+        order = randomizer.order(
+            constraint=constraint,
+            levels=self.trials.data['level'],
+            blocks=self.trials.data['list_num'],
+            max_run=max_run,
+            session=session
+        )
+        self.trials.permute(order)
+        self._trial = None
+        self.seed = str(randomizer.seed)
+        return self.seed
+
+
+    def start(self, slm_cal_value, raw_lvl, counter=0):
+        """ Calculate raw levels once for the whole session
+            from the current calibration, and go to trial
+            COUNTER (0 for a new session)
+        """
+        self.levels = l.LevelTable(self.trials.data['level'],
+            slm_cal_value=slm_cal_value, raw_lvl=raw_lvl)
+        self.counter = counter
+        self._trial = None
+
+
+    def level(self):
+        """ Return (presentation level (dB), raw level (dB FS),
+            gain) for the current trial
+        """
+        db_lvl = self.trial.level
+        raw_lvl, gain = self.levels[db_lvl]
+        return db_lvl, raw_lvl, gain
+
+
+    def audio(self):
+        """ Return the current trial's Audio object, leveled
+            for presentation (prefetched when available)
+        """
+        _, raw_lvl, gain = self.level()
+        file_path = self.trial.audio
+        audio = None
+        if self.prefetcher is not None:
+            audio = self.prefetcher.take(self.counter, file_path, raw_lvl)
+        if audio is None:
+            audio = a.Audio(file_path, raw_lvl, gain)
+        return audio
+
+
+    def present(self, device_id, channels, on_done=None):
+        """ Present the current trial's audio, then start
+            loading the next trial's audio. ON_DONE is called
+            when the last sample has played. Raises ValueError
+            for an invalid audio device.
+        """
+        audio = self.audio()
+        audio.play(device_id=device_id, channels=channels,
+            player=self.player, on_done=on_done)
+        self.prefetch()
+        return audio
+
+
+    def prefetch(self):
+        """ Send the next trial's audio file and levels to the
+            prefetcher
+        """
+        next_trial = self.counter + 1
+        if self.prefetcher is None or next_trial >= len(self.trials):
+            return
+        trial = self.trials[next_trial]
+        raw_lvl, gain = self.levels[trial.level]
+        self.prefetcher.submit(next_trial, trial.audio, raw_lvl, gain)
+
+
+    def score(self, correct):
+        """ Score the current trial. CORRECT holds the word
+            positions of the key words repeated correctly.
+            Returns the result (and passes it to on_result).
+        """
+        correct = set(correct)
+        trial = self.trial
+        # Split key words (keeps repeated key words, in sentence order)
+        words_correct = []
+        words_incorrect = []
+        for idx in trial.keywords:
+            if idx in correct:
+                words_correct.append(trial.words[idx])
+            else:
+                words_incorrect.append(trial.words[idx])
+
+        result = {
+            'Words Correct': ' '.join(words_correct),
+            'Num Words Correct': len(words_correct),
+            'Words Incorrect': ' '.join(words_incorrect),
+            'Trial': self.trial_num,
+            'Outcome': 1 if len(words_correct) >= self.criterion else 0
+        }
+        if self.on_result is not None:
+            self.on_result(result)
+        return result
+
+
+    def advance(self):
+        """ Go to the next trial. Returns False (and stays on
+            the last trial) when the session is done.
+        """
+        if self.is_last:
+            return False
+        self.counter += 1
+        self._trial = None
+        return True
+
+
+class NullPlayer:
+    """ Player for headless runs: plays nothing, and reports
+        each presentation as finished at once
+    """
+    def play(self, data, fs, device_id, mapping, interrupt=True,
+        on_done=None):
+        if on_done is not None:
+            on_done()
+
+
+    def close(self):
+        pass
@@ -12,7 +12,8 @@ class ScoreModel:
         'Num Words Correct': {'type': 'int', 'value': 0},
         'Words Incorrect': {'type': 'str', 'value': ''},
         'Outcome': {'type': 'int', 'value': None},
-        'Trial': {'type': 'int', 'value': None}
+        'Trial': {'type': 'int', 'value': None},
+        'Random Seed': {'type': 'str', 'value': ''}
     }
 
 
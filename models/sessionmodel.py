@@ -5,6 +5,9 @@
 # IMPORTS  #
 ############
 # Import system packages
+import os
+import atexit
+import threading
 from pathlib import Path
 
 # Import data handling packages
@@ -25,6 +28,10 @@ class SessionParsModel:
         'sentences_per_list': {'type': 'int', 'value': 10},
         'score_criterion': {'type': 'int', 'value': 5},
         'randomize': {'type': 'int', 'value': 0},
+        'random_seed': {'type': 'str', 'value': ''},
+        'random_constraint': {'type': 'str', 'value': 'None'},
+        'max_level_run': {'type': 'int', 'value': 3},
+        'session_number': {'type': 'int', 'value': 1},
         'Speaker Number': {'type': 'int', 'value': 1},
         'Audio Files Path': {'type': 'str', 'value': 'Please select a path'},
         'Sentence File Path': {'type': 'str', 'value': 'Please select a path'},
@@ -34,9 +41,17 @@ class SessionParsModel:
         'slm_offset': {'type': 'float', 'value': 95.0},
         'new_raw_lvl': {'type': 'float', 'value': -30},
         'new_db_lvl': {'type': 'float', 'value': 65.0},
-        'Calibration File': {'type': 'str', 'value': 'cal_stim.wav'}
+        'Calibration File': {'type': 'str', 'value': 'cal_stim.wav'},
+        'Results Database': {'type': 'str', 'value': ''}
     }
 
+    # Fields not written to the data file
+    not_saved = ('Speaker Number', 'Audio Files Path', 'Sentence File Path', 
+        'Audio Device ID', 'Calibration File', 'Results Database')
+
+    # Seconds to wait for further changes before writing
+    delay = 1.0
+
     def __init__(self):
         # Create session parameters file
         filename = 'speech_task_pars.json'
@@ -44,9 +59,18 @@ class SessionParsModel:
         # Store settings file in user's home directory
         self.filepath = Path.home() / filename
 
+        # Keys changed since the last write
+        self.dirty = set()
+        self._timer = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
         # Load settings file
         self.load()
 
+        # Write any pending changes when Python exits
+        atexit.register(self.flush)
+
 
     def load(self):
         """ Load session parameters from file
@@ -59,8 +83,13 @@ class SessionParsModel:
         # Open the file and read in the raw values
         print("Models_Session_59: File found - reading raw values from " +
             "parameter file...")
-        with open(self.filepath, 'r') as fh:
-            raw_values = json.load(fh)
+        try:
+            with open(self.filepath, 'r') as fh:
+                raw_values = json.load(fh)
+        except ValueError:
+            print("Models_Session: Could not read parameter file - " +
+                "using defaults")
+            return
 
         # Don't implicitly trust the raw values: only get known keys
         print("Models_Session_65: Loading vals into sessionpars model " +
@@ -70,26 +99,66 @@ class SessionParsModel:
             if key in raw_values and 'value' in raw_values[key]:
                 raw_value = raw_values[key]['value']
                 self.fields[key]['value'] = raw_value
+        self.dirty.clear()
 
 
     def save(self):
-        """ Save current session parameters to file 
+        """ Schedule a write of changed session parameters. 
+            Changes made within DELAY seconds are combined 
+            into a single write.
         """
-        # Write to JSON file
-        print("Models_Session_78: Writing session pars from model to file...")
-        with open(self.filepath, 'w') as fh:
-            json.dump(self.fields, fh)
+        with self._lock:
+            if not self.dirty or self._timer is not None:
+                return
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+
+    def flush(self):
+        """ Write session parameters to file now, if anything 
+            has changed. Written to a temporary file first and
+            then renamed, so the file is never left half-written.
+        """
+        # Writes happen one at a time; values are copied under 
+        # the lock so changes aren't blocked by a slow disk
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self.dirty:
+                    return
+                changed = sorted(self.dirty)
+                text = json.dumps(self.fields)
+                self.dirty.clear()
+
+            print("Models_Session_78: Writing session pars from model " +
+                f"to file (changed: {', '.join(changed)})")
+            temp = self.filepath.with_name(self.filepath.name + '.tmp')
+            try:
+                with open(temp, 'w') as fh:
+                    fh.write(text)
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                os.replace(temp, self.filepath)
+            except OSError:
+                print("Models_Session: Could not write parameter file!")
+                # Try again on the next write
+                with self._lock:
+                    self.dirty.update(changed)
 
 
     def set(self, key, value):
         """ Set a variable value 
         """
-        print("Models_Session_85: Setting sessionpars model " +
-            "fields with running vals...")
         if (
             key in self.fields and 
             type(value).__name__ == self.fields[key]['type']
         ):
-            self.fields[key]['value'] = value
+            with self._lock:
+                if self.fields[key]['value'] != value:
+                    self.fields[key]['value'] = value
+                    self.dirty.add(key)
         else:
             raise ValueError("Bad key or wrong variable type")
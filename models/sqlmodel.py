@@ -0,0 +1,222 @@
+""" Model for storing trial records from every session in a
+    single SQLite database.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import csv
+import sqlite3
+from datetime import datetime
+
+
+#########
+# BEGIN #
+#########
+class ResultsDB:
+    """ Write trial records (the same values written to the
+        .csv file) to the 'trials' table of a SQLite database.
+        Each record field gets its own column; the table gains
+        new columns if later records have new fields. Each row
+        also stores the data file name ('Session') and the time
+        it was saved ('Date').
+
+        The database uses WAL mode, so it can be queried (see
+        query and export_csv) while a session is writing to
+        it. Subject, condition, level and date are indexed.
+
+        Used as a RecordWriter sink (save_record, flush_if_due
+        and close). The connection is opened by the first
+        record, on the writer thread.
+    """
+    table = 'trials'
+    indexes = {
+        'subject': 'Subject',
+        'condition': 'Condition',
+        'level': 'new_db_lvl',
+        'date': 'Date'
+    }
+
+    def __init__(self, db_path, session=''):
+        self.db_path = str(db_path)
+        self.session = str(session)
+        self.columns = None
+        self._conn = None
+
+
+    def connect(self):
+        """ Open the database and create the table and indexes
+        """
+        self._conn = connect(self.db_path)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} " +
+            "(id INTEGER PRIMARY KEY, \"Session\" TEXT, \"Date\" TEXT)")
+        self.columns = table_columns(self._conn, self.table)
+        self._conn.commit()
+
+
+    def save_record(self, data):
+        """ Insert one trial record
+        """
+        if self._conn is None:
+            self.connect()
+
+        row = dict(data, Session=self.session,
+            Date=datetime.now().isoformat(timespec='seconds'))
+        self._add_columns(row)
+
+        names = ', '.join(_quote(key) for key in row)
+        marks = ', '.join('?' for _ in row)
+        with self._conn:
+            self._conn.execute(
+                f"INSERT INTO {self.table} ({names}) VALUES ({marks})",
+                [_to_sql(value) for value in row.values()])
+        print("Models_sqlmodel: Record saved to results database")
+
+
+    def flush_if_due(self):
+        """ Each record is committed as it is written
+        """
+        pass
+
+
+    def close(self):
+        """ Close the database connection
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+    def _add_columns(self, row):
+        """ Add columns (and their indexes) for new fields
+        """
+        new = [key for key in row if key not in self.columns]
+        if not new:
+            return
+        with self._conn:
+            for key in new:
+                self._conn.execute(f"ALTER TABLE {self.table} ADD COLUMN " +
+                    f"{_quote(key)} {_sql_type(row[key])}")
+                self.columns.append(key)
+            for name, column in self.indexes.items():
+                if column in self.columns:
+                    self._conn.execute("CREATE INDEX IF NOT EXISTS " +
+                        f"idx_{self.table}_{name} ON {self.table} " +
+                        f"({_quote(column)})")
+
+
+def connect(db_path):
+    """ Open a connection in WAL mode (readers don't block
+        the writer, and vice versa)
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def table_columns(conn, table=ResultsDB.table):
+    """ Return column names of TABLE (without 'id')
+    """
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")
+        if row[1] != 'id']
+
+
+def query(db_path, subject=None, condition=None, level=None, since=None,
+    until=None):
+    """ Return trial records (dictionaries) matching all
+        given values. SINCE and UNTIL are dates or ISO date
+        strings (inclusive).
+
+        EXAMPLE: all trials for subject 123 at 55 dB
+            query('results.db', subject='123', level=55)
+    """
+    where, params = _filters(subject, condition, level, since, until)
+    conn = connect(db_path)
+    try:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(f"SELECT * FROM {ResultsDB.table}{where} " +
+            "ORDER BY id", params).fetchall()
+    finally:
+        conn.close()
+    return [{key: row[key] for key in row.keys() if key != 'id'}
+        for row in rows]
+
+
+def export_csv(db_path, csv_path, **filters):
+    """ Write matching trial records to a .csv file with the
+        same columns as the session .csv files (plus Session
+        and Date). Takes the same filters as query. Returns
+        the number of rows written.
+    """
+    where, params = _filters(**filters)
+    conn = connect(db_path)
+    try:
+        columns = [key for key in table_columns(conn)
+            if key not in ('Session', 'Date')] + ['Session', 'Date']
+        names = ', '.join(_quote(key) for key in columns)
+        rows = conn.execute(f"SELECT {names} FROM {ResultsDB.table}" +
+            f"{where} ORDER BY id", params)
+        count = 0
+        with open(csv_path, 'w', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    finally:
+        conn.close()
+    return count
+
+
+def _filters(subject=None, condition=None, level=None, since=None,
+    until=None):
+    """ Build a WHERE clause and parameters
+    """
+    clauses = []
+    params = []
+    for column, value in (('Subject', subject), ('Condition', condition),
+        ('new_db_lvl', level)):
+        if value is not None:
+            clauses.append(f"{_quote(column)} = ?")
+            params.append(value)
+    if since is not None:
+        clauses.append("\"Date\" >= ?")
+        params.append(str(since))
+    if until is not None:
+        until = str(until)
+        if 'T' not in until:
+            # Include the whole of the end date
+            until += 'T23:59:59'
+        clauses.append("\"Date\" <= ?")
+        params.append(until)
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return where, params
+
+
+def _quote(name):
+    """ Quote a column name (names may contain spaces)
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sql_type(value):
+    """ SQLite column type for a Python value
+    """
+    if isinstance(value, bool) or isinstance(value, int):
+        return 'INTEGER'
+    if isinstance(value, float):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _to_sql(value):
+    """ Convert a value to a type SQLite stores directly
+    """
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if hasattr(value, 'item'):
+        # NumPy values
+        return value.item()
+    return str(value)
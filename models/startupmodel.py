@@ -0,0 +1,193 @@
+""" Model for measuring application start-up time.
+
+    Only uses the standard library, so it can be imported
+    (and start timing) before anything else.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import sys
+import builtins
+import threading
+import importlib.util
+from time import perf_counter
+from pathlib import Path
+
+
+#########
+# BEGIN #
+#########
+class StartupReport:
+    """ Record import times and time to first paint, print
+        a summary and write it to the user's home directory.
+
+        After watch_imports is called, every module import is
+        timed. The report lists each module that took at least
+        MIN_SECS to load, in load order, with its total time
+        (including the modules it imported) and its own time.
+
+        Heavy packages should not be loaded before the main
+        window appears; any that are get flagged in the
+        report. Those loaded later (when first needed) are
+        printed and added to the report file as they load. A
+        warning is printed if first paint takes longer than
+        BUDGET seconds.
+    """
+    budget = 2.0
+    min_secs = 0.005
+    deferred = ('pandas', 'scipy', 'sounddevice', 'markdown', 'pandastable')
+    filename = 'speech_task_startup.txt'
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.imports = []
+        self.marks = []
+        self.late = []
+        self.filepath = Path.home() / self.filename
+        self.reported = False
+        self._import = None
+        self._local = threading.local()
+        self._timed = set()
+        self._lock = threading.Lock()
+
+
+    def watch_imports(self):
+        """ Time every module imported from now on (wraps
+            the built-in __import__)
+        """
+        if self._import is None:
+            self._import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(),
+        level=0):
+        """ Import as usual, recording the time taken if the
+            module (or modules in FROMLIST) had to be loaded.
+            Modules loaded by nested imports are timed
+            separately and left out of this module's own time.
+        """
+        module = name
+        if level:
+            try:
+                module = importlib.util.resolve_name('.' * level + name,
+                    _package(globals))
+            except (ImportError, ValueError):
+                pass
+        parts = module.split('.')
+        targets = ['.'.join(parts[:ii]) for ii in range(1, len(parts) + 1)]
+        targets += [f"{module}.{item}" for item in fromlist or ()
+            if item != '*']
+        missing = [target for target in targets if target not in sys.modules]
+        if not missing:
+            return self._import(name, globals, locals, fromlist, level)
+
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            total = perf_counter() - start
+            nested = stack.pop()
+            # Leave out modules timed by nested imports
+            loaded = [target for target in missing
+                if target in sys.modules and target not in self._timed]
+            self._timed.update(loaded)
+            if stack:
+                # Timed imports inside this one aren't the outer 
+                # module's own time either
+                stack[-1] += total if loaded else nested
+            if loaded:
+                # Name the deepest package loaded, or the 
+                # submodules loaded from it
+                packages = [target for target in loaded
+                    if target in targets[:len(parts)]]
+                submodules = loaded[len(packages):]
+                if packages:
+                    label = packages[-1]
+                elif len(submodules) <= 2:
+                    label = ', '.join(submodules)
+                else:
+                    label = f"{module} ({len(submodules)} submodules)"
+                self._record(label, total, total - nested, not stack)
+
+
+    def _record(self, module, total, own, outermost):
+        """ Store one module's load time
+        """
+        self.imports.append((module, total, own))
+        package = module.split('.')[0]
+        if self.reported and outermost and package in self.deferred:
+            line = f"Loaded after first paint: {module} ({total:.3f} s)"
+            self.late.append(line)
+            print(f"Models_startupmodel: {line}")
+            with self._lock:
+                self._write(line, 'a')
+
+
+    def mark(self, name):
+        """ Record time since start for a milestone
+        """
+        self.marks.append((name, perf_counter() - self.start))
+
+
+    def loaded_early(self):
+        """ Return deferred packages that are already loaded
+        """
+        return [name for name in self.deferred if name in sys.modules]
+
+
+    def report(self):
+        """ Print the start-up report and write it to file
+        """
+        imports = list(self.imports)
+        lines = ["Start-up report",
+            f"Imports (s; modules taking {self.min_secs} s or more):",
+            f"    {'module':<32}{'total':>8}{'own':>8}"]
+        lines += [f"    {name:<32}{total:8.3f}{own:8.3f}"
+            for name, total, own in imports if total >= self.min_secs]
+        lines.append(f"    {len(imports)} imports in " +
+            f"{sum(own for _, _, own in imports):.3f} s")
+        lines.append("Milestones (s since start):")
+        lines += [f"    {name:<32}{secs:8.3f}" for name, secs in self.marks]
+
+        early = self.loaded_early()
+        if early:
+            lines.append("Loaded before first paint: " + ', '.join(early))
+
+        total = self.marks[-1][1] if self.marks else perf_counter() - self.start
+        if total > self.budget:
+            lines.append(f"WARNING: Start-up took {total:.2f} s " +
+                f"(budget: {self.budget:.2f} s)")
+
+        text = '\n'.join(lines)
+        print(f"\nModels_startupmodel: {text}")
+        with self._lock:
+            self._write(text, 'w')
+            self.reported = True
+
+
+    def _write(self, text, mode):
+        """ Write (or append) TEXT to the report file
+        """
+        try:
+            with open(self.filepath, mode) as fh:
+                fh.write(text + '\n')
+        except OSError:
+            print("Models_startupmodel: Could not write start-up report!")
+
+
+def _package(globals):
+    """ Package that relative imports in a module (given its
+        GLOBALS) are resolved from
+    """
+    globals = globals or {}
+    package = globals.get('__package__')
+    if package is None:
+        package = globals.get('__name__', '')
+        if '__path__' not in globals:
+            package = package.rpartition('.')[0]
+    return package
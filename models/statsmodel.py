@@ -0,0 +1,170 @@
+""" Model for running summary statistics, updated one trial
+    at a time.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import math
+import threading
+
+
+#########
+# BEGIN #
+#########
+class LevelStats:
+    """ Running totals for one presentation level. The
+        variance of the per-sentence proportion of words
+        correct is kept with Welford's method, so nothing
+        is rescanned when a trial is added.
+    """
+    __slots__ = ('trials', 'sentences_correct', 'words_correct',
+        'words_total', 'mean', 'm2')
+
+    def __init__(self):
+        self.trials = 0
+        self.sentences_correct = 0
+        self.words_correct = 0
+        self.words_total = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+
+    def add(self, outcome, words_correct, words_total):
+        """ Add one scored sentence
+        """
+        self.trials += 1
+        self.sentences_correct += 1 if outcome else 0
+        self.words_correct += words_correct
+        self.words_total += words_total
+
+        # Welford update for proportion of words correct
+        prop = words_correct / words_total if words_total else 0.0
+        delta = prop - self.mean
+        self.mean += delta / self.trials
+        self.m2 += delta * (prop - self.mean)
+
+
+    @property
+    def pc_sentence(self):
+        """ Percent sentences correct """
+        if not self.trials:
+            return None
+        return self.sentences_correct / self.trials * 100
+
+
+    @property
+    def pc_word(self):
+        """ Percent of all key words correct """
+        if not self.words_total:
+            return None
+        return self.words_correct / self.words_total * 100
+
+
+    @property
+    def variance(self):
+        """ Sample variance of the per-sentence proportion of
+            words correct (None for fewer than 2 trials)
+        """
+        if self.trials < 2:
+            return None
+        return self.m2 / (self.trials - 1)
+
+
+    @property
+    def sem(self):
+        """ Standard error of the mean proportion of words
+            correct, in percent
+        """
+        variance = self.variance
+        if variance is None:
+            return None
+        return math.sqrt(variance / self.trials) * 100
+
+
+class RunningStats:
+    """ Per-level and overall summary of a session, updated
+        in constant time per trial (see add_record).
+
+        A summary is available at any point in the session
+        without rereading earlier trials. Safe to read from
+        another thread while trials are being added.
+    """
+    def __init__(self):
+        self.levels = dict()
+        self.total = LevelStats()
+        self._lock = threading.Lock()
+
+
+    def add(self, level, outcome, words_correct, words_total):
+        """ Add one scored sentence presented at LEVEL
+        """
+        with self._lock:
+            stats = self.levels.get(level)
+            if stats is None:
+                stats = self.levels[level] = LevelStats()
+            stats.add(outcome, words_correct, words_total)
+            self.total.add(outcome, words_correct, words_total)
+
+
+    def add_record(self, data):
+        """ Add one trial record (the values written to the
+            data file)
+        """
+        words_correct = int(data['Num Words Correct'])
+        words_total = words_correct + len(
+            str(data['Words Incorrect'] or '').split())
+        self.add(data['new_db_lvl'], data['Outcome'], words_correct,
+            words_total)
+
+
+    def __len__(self):
+        return self.total.trials
+
+
+    def summary(self):
+        """ Return one dictionary per level (in level order),
+            followed by the overall totals (Level 'All')
+        """
+        with self._lock:
+            rows = [_row(level, self.levels[level])
+                for level in sorted(self.levels)]
+            rows.append(_row('All', self.total))
+        return rows
+
+
+    def summary_text(self):
+        """ Return the summary as lines of text for display
+        """
+        lines = []
+        for row in self.summary():
+            level = row['Level']
+            label = f"{level} dB" if level != 'All' else 'All levels'
+            lines.append(f"{label}: {_fmt(row['PC Word'])}% words, " +
+                f"{_fmt(row['PC Sentence'])}% sentences " +
+                f"(n = {row['Trials']}, SE = {_fmt(row['SE Word'])})")
+        return '\n'.join(lines)
+
+
+def _row(level, stats):
+    """ Summary dictionary for one level
+    """
+    return {
+        'Level': level,
+        'Trials': stats.trials,
+        'Sentences Correct': stats.sentences_correct,
+        'Words Correct': stats.words_correct,
+        'Words Total': stats.words_total,
+        'PC Sentence': _round(stats.pc_sentence),
+        'PC Word': _round(stats.pc_word),
+        'SE Word': _round(stats.sem)
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def _fmt(value):
+    return '-' if value is None else f"{value:g}"
@@ -0,0 +1,117 @@
+""" Model for the sequence of trials in a session.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+
+#########
+# BEGIN #
+#########
+class Trial:
+    """ Values of a single trial (one row of a TrialSequence)
+    """
+    __slots__ = ('row', 'list_num', 'sentence_num', 'level', 'sentence',
+        'audio', 'words', 'keywords')
+
+    def __init__(self, sequence, row):
+        self.row = row
+        for name in TrialSequence.columns:
+            setattr(self, name, sequence.data[name][row])
+
+
+class TrialSequence:
+    """ Trials stored as NumPy columns, presented in the order
+        given by a permutation index. Trial access is O(1),
+        and randomizing only reorders the integer index.
+
+        Indexing (seq[i]) returns the i-th trial in
+        presentation order as a Trial.
+    """
+    columns = ('list_num', 'sentence_num', 'level', 'sentence', 'audio',
+        'words', 'keywords')
+    _object_columns = ('sentence', 'audio', 'words', 'keywords')
+
+    def __init__(self, data, order=None):
+        self.data = data
+        size = len(data['level'])
+        if order is None:
+            order = np.arange(size)
+        self.order = np.asarray(order, dtype=np.intp)
+
+
+    @classmethod
+    def from_frame(cls, stim_master):
+        """ Build from the listmodel's stim_master dataframe
+        """
+        data = {name: stim_master[name].to_numpy() for name in cls.columns}
+        return cls(data)
+
+
+    @classmethod
+    def from_dict(cls, columns, order=None):
+        """ Build from plain lists (see to_dict), e.g., as 
+            read back from a session journal
+        """
+        data = dict()
+        for name in cls.columns:
+            values = columns[name]
+            if name in cls._object_columns:
+                # Fill element by element so lists stay lists
+                column = np.empty(len(values), dtype=object)
+                for ii, value in enumerate(values):
+                    column[ii] = tuple(value) if name == 'keywords' else value
+            else:
+                column = np.asarray(values)
+            data[name] = column
+        return cls(data, order)
+
+
+    def to_dict(self):
+        """ Return trial columns (stored order) as plain lists
+        """
+        return {name: [value.item() if isinstance(value, np.generic) 
+            else value for value in self.data[name].tolist()]
+            for name in self.columns}
+
+
+    def __len__(self):
+        return len(self.order)
+
+
+    def __getitem__(self, index):
+        return Trial(self, self.order[index])
+
+
+    def column(self, name):
+        """ Return a column in presentation order
+        """
+        return self.data[name][self.order]
+
+
+    def permute(self, order):
+        """ Set a new presentation order (array of row numbers)
+        """
+        order = np.asarray(order, dtype=np.intp)
+        if sorted(order.tolist()) != list(range(len(self.data['level']))):
+            raise ValueError("Order must be a permutation of the trials")
+        self.order = order
+
+
+    def shuffle(self, rng=None):
+        """ Randomize the presentation order
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        self.order = rng.permutation(len(self.data['level']))
+
+
+    def to_frame(self):
+        """ Return trials in presentation order as a dataframe
+        """
+        import pandas as pd
+        return pd.DataFrame({name: self.column(name)
+            for name in self.columns})
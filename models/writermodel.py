@@ -0,0 +1,137 @@
+""" Model for writing trial records on a background thread.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import queue
+import atexit
+import threading
+
+
+#########
+# BEGIN #
+#########
+class WriterBehind(Exception):
+    """ Passed to ON_ERROR when records are waiting in memory
+        because the sinks are slow (nothing is lost)
+    """
+
+
+class RecordWriter:
+    """ Pass records (dictionaries) to one or more sinks
+        (e.g., a CSVModel) on a worker thread, so slow disks
+        never block the GUI.
+
+        Sinks provide save_record(data), flush_if_due() and
+        close(). put() never waits: if the sinks fall MAXSIZE 
+        records behind (e.g., a stalled network drive), later 
+        records wait in memory and are written in order once 
+        the sinks catch up. A WriterBehind is passed to 
+        ON_ERROR once each time this happens.
+
+        Errors raised by a sink are passed to ON_ERROR (called
+        on the worker thread, so it must not call Tk) and kept 
+        in self.errors. The failed record is skipped; later 
+        records are still written. close() writes every queued 
+        record before closing the sinks, and is also run at 
+        exit.
+    """
+    # Seconds between checks for time-based flushing
+    poll_secs = 0.5
+    # Longest wait for queued records in close()
+    close_timeout = 30
+
+    def __init__(self, sinks, maxsize=64, on_error=None):
+        self.sinks = list(sinks)
+        self.maxsize = maxsize
+        self.on_error = on_error
+        self.errors = []
+        self._queue = queue.Queue()
+        self._behind = False
+        self._closed = False
+        self._close_sent = False
+        self._thread = threading.Thread(target=self._run,
+            name='record-writer', daemon=True)
+        self._thread.start()
+
+        # Don't lose queued records if the app exits early
+        atexit.register(self.close)
+
+
+    def put(self, data, sinks=None):
+        """ Queue a record for writing to SINKS (default: all
+            sinks). Never blocks.
+        """
+        if self._closed:
+            raise RuntimeError("Record writer is closed")
+        self._queue.put(('record', (data, sinks)))
+
+        # Report back-pressure once until the sinks catch up
+        waiting = self._queue.qsize()
+        if waiting > self.maxsize and not self._behind:
+            self._behind = True
+            print(f"Models_writermodel: {waiting} records waiting to be saved")
+            if self.on_error is not None:
+                self.on_error(WriterBehind(
+                    f"{waiting} records waiting to be saved"))
+
+
+    def add_sink(self, sink):
+        """ Add a sink for all records queued after this call
+        """
+        self._queue.put(('add', sink))
+
+
+    def close(self, timeout=None):
+        """ Write all queued records, then close the sinks.
+            Waits up to TIMEOUT seconds (default: close_timeout)
+            and returns True once the writer has finished, or
+            False if it is still writing (e.g., a network drive
+            is not responding). Call again to keep waiting.
+        """
+        if timeout is None:
+            timeout = self.close_timeout
+        self._closed = True
+        if not self._close_sent:
+            self._queue.put(('close', None))
+            self._close_sent = True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+    def _run(self):
+        """ Write queued records (runs on worker thread)
+        """
+        while True:
+            try:
+                kind, data = self._queue.get(timeout=self.poll_secs)
+            except queue.Empty:
+                # Caught up
+                self._behind = False
+                self._each_sink('flush_if_due')
+                continue
+
+            if kind == 'close':
+                self._each_sink('close')
+                return
+            if kind == 'add':
+                self.sinks.append(data)
+                continue
+            data, sinks = data
+            self._each_sink('save_record', data, sinks=sinks)
+
+
+    def _each_sink(self, method, *args, sinks=None):
+        """ Call a method on every sink, reporting errors
+        """
+        for sink in sinks or self.sinks:
+            try:
+                getattr(sink, method)(*args)
+            except Exception as e:
+                print(f"Models_writermodel: {type(sink).__name__}." +
+                    f"{method} failed: {e}")
+                self.errors.append(e)
+                if self.on_error is not None:
+                    self.on_error(e)
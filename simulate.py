@@ -0,0 +1,213 @@
+""" Run simulated Speech Task Controller sessions without a
+    display, to measure trial throughput and profile the
+    trial loop.
+
+    Builds a synthetic session (sentences with key words at
+    each presentation level) and runs it through the same
+    TrialRunner the app uses. A simulated listener repeats
+    each key word correctly with the probability given by a
+    logistic psychometric function. Results are passed to the
+    running statistics shown in the end-of-session summary.
+
+    With --audio, every trial also reads and levels a short
+    .wav file (written to a temporary directory), with the
+    next file prefetched, and "plays" it through a
+    NullPlayer.
+
+    Usage:
+        python simulate.py [--trials N] [--levels DB [DB ...]]
+            [--audio] [--randomize CONSTRAINT] [--fit] [--profile]
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+# Import data science packages
+import numpy as np
+
+# Import custom modules
+from models import fitmodel as m_fit
+from models import prefetchmodel as m_prefetch
+from models import randommodel as m_random
+from models import runnermodel as m_runner
+from models import statsmodel as m_stats
+from models import trialmodel as m_trial
+
+
+#########
+# BEGIN #
+#########
+# Calibration used for simulated sessions
+SLM_CAL_VALUE = 70.0
+RAW_LVL = -30.0
+
+
+def make_trials(num_trials, levels, keywords, audio_files=None):
+    """ Build a TrialSequence of NUM_TRIALS sentences, each
+        with KEYWORDS key words, cycling through LEVELS
+    """
+    words = [f"word{ii}" for ii in range(keywords * 2)]
+    columns = {
+        'list_num': [ii // 10 + 1 for ii in range(num_trials)],
+        'sentence_num': [ii % 10 + 1 for ii in range(num_trials)],
+        'level': [levels[ii % len(levels)] for ii in range(num_trials)],
+        'sentence': [' '.join(words)] * num_trials,
+        'audio': [audio_files[ii % len(audio_files)] if audio_files
+            else '' for ii in range(num_trials)],
+        'words': [words] * num_trials,
+        'keywords': [list(range(0, keywords * 2, 2))] * num_trials
+    }
+    return m_trial.TrialSequence.from_dict(columns)
+
+
+def write_audio(directory, count=10, fs=44100, dur=2.0):
+    """ Write COUNT noise .wav files to DIRECTORY. Returns
+        their paths.
+    """
+    from scipy.io import wavfile
+    rng = np.random.default_rng(0)
+    paths = []
+    for ii in range(count):
+        path = os.path.join(directory, f"sentence_{ii}.wav")
+        sig = rng.normal(scale=0.1, size=int(fs * dur)).astype(np.float32)
+        wavfile.write(path, fs, sig)
+        paths.append(path)
+    return paths
+
+
+class Listener:
+    """ Simulated listener: each key word is repeated
+        correctly with probability psi(level)
+    """
+    def __init__(self, levels, threshold=50.0, slope=0.3, lapse=0.02,
+        seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.p = {float(level): float(m_fit.psi((threshold, slope, lapse),
+            level)) for level in levels}
+
+
+    def respond(self, trial):
+        """ Return the word positions repeated correctly
+        """
+        hits = self.rng.random(len(trial.keywords)) < self.p[float(trial.level)]
+        return [idx for idx, hit in zip(trial.keywords, hits) if hit]
+
+
+def run(runner, listener, audio):
+    """ Run every trial. Returns the time (s) taken by each.
+    """
+    runner.start(SLM_CAL_VALUE, RAW_LVL)
+    times = []
+    while True:
+        start = time.perf_counter()
+        if audio:
+            runner.present(device_id=0, channels=1)
+        else:
+            runner.level()
+        runner.score(listener.respond(runner.trial))
+        more = runner.advance()
+        times.append(time.perf_counter() - start)
+        if not more:
+            return times
+
+
+def report(times):
+    """ Print throughput and per-trial times
+    """
+    times = np.asarray(times) * 1000
+    total = times.sum() / 1000
+    print(f"\nSimulate: {len(times)} trials in {total:.3f} s " +
+        f"({len(times) / total:,.0f} trials/s)")
+    print("Simulate: Time per trial (ms): " +
+        f"mean {times.mean():.4f}, " +
+        ", ".join(f"p{q} {v:.4f}" for q, v in
+            zip((50, 95, 99), np.percentile(times, [50, 95, 99]))) +
+        f", max {times.max():.4f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run simulated sessions without a display.")
+    parser.add_argument('--trials', type=int, default=10000,
+        help="Number of trials (default: %(default)s)")
+    parser.add_argument('--levels', type=float, nargs='+',
+        default=[40, 45, 50, 55, 60, 65],
+        help="Presentation levels in dB (default: %(default)s)")
+    parser.add_argument('--keywords', type=int, default=5,
+        help="Key words per sentence (default: %(default)s)")
+    parser.add_argument('--criterion', type=int, default=3,
+        help="Key words correct to score a sentence correct " +
+            "(default: %(default)s)")
+    parser.add_argument('--threshold', type=float, default=50.0,
+        help="Simulated listener's threshold in dB (default: %(default)s)")
+    parser.add_argument('--slope', type=float, default=0.3,
+        help="Simulated listener's slope per dB (default: %(default)s)")
+    parser.add_argument('--randomize', choices=m_random.Randomizer.constraints,
+        default=None, help="Randomize trial order with this constraint")
+    parser.add_argument('--seed', default='0',
+        help="Random seed for trial order and listener (default: %(default)s)")
+    parser.add_argument('--audio', action='store_true',
+        help="Read, level and prefetch a .wav file for every trial")
+    parser.add_argument('--fit', action='store_true',
+        help="Fit a psychometric function to the results")
+    parser.add_argument('--profile', action='store_true',
+        help="Profile the trial loop and print the slowest functions")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        audio_files = write_audio(directory) if args.audio else None
+        trials = make_trials(args.trials, args.levels, args.keywords,
+            audio_files)
+
+        stats = m_stats.RunningStats()
+        def on_result(result):
+            stats.add(runner.trial.level, result['Outcome'],
+                result['Num Words Correct'], len(runner.trial.keywords))
+
+        prefetcher = m_prefetch.Prefetcher() if args.audio else None
+        runner = m_runner.TrialRunner(trials, args.criterion,
+            player=m_runner.NullPlayer(), prefetcher=prefetcher,
+            on_result=on_result)
+        if args.randomize:
+            runner.randomize(args.seed, args.randomize)
+        listener = Listener(args.levels, args.threshold, args.slope,
+            seed=int(args.seed))
+
+        # Audio prints a few lines per file; keep the report readable
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            if args.profile:
+                import cProfile
+                profiler = cProfile.Profile()
+                times = profiler.runcall(run, runner, listener, args.audio)
+            else:
+                times = run(runner, listener, args.audio)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            if prefetcher is not None:
+                prefetcher.shutdown()
+
+    report(times)
+    print(f"\n{stats.summary_text()}")
+
+    if args.profile:
+        import pstats
+        print()
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+    if args.fit:
+        result = m_fit.fit_with_ci(*m_fit.from_stats(stats))
+        print(f"\n{m_fit.summary_text(result)}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
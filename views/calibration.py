@@ -203,6 +203,8 @@ class CalibrationDialog(tk.Toplevel):
         self.sessionpars['Calibration File'].set(filedialog.askopenfilename())
         self.cal_path.set(
             os.path.basename(self.sessionpars['Calibration File'].get()))
+        # Start measuring the file before it's played
+        self.parent.event_generate('<<CalFileLoaded>>')
 
 
     def _on_play(self):
@@ -11,22 +11,31 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 
-# Import data science packages
-import numpy as np
-import random
+# Import system packages
+import queue
 
 # Import text packages
 import string # for creating alphabet list
 
 # Import custom modules
-from models import audiomodel as a
+from models import prefetchmodel as p
+from models import runnermodel as rm
+from models import trialmodel as t
 
 
 #########
 # BEGIN #
 #########
 class MainFrame(ttk.Frame):
-    def __init__(self, parent, scoremodel, sessionpars, listmodel, 
+    """ Display and scoring view. Trial sequencing, levels,
+        audio and scoring are done by a TrialRunner; this
+        frame shows each trial, collects the checkbutton 
+        responses and passes results to the controller.
+    """
+    # Milliseconds between checks for finished presentations
+    poll_ms = 20
+
+    def __init__(self, parent, scoremodel, sessionpars, listmodel, player,
     *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
 
@@ -34,7 +43,11 @@ class MainFrame(ttk.Frame):
         self.scoremodel = scoremodel
         self.sessionpars = sessionpars
         self.listmodel = listmodel
-        self.counter = 0
+        self.player = player
+        self.runner = None
+
+        # Load upcoming audio while the current trial is scored
+        self.prefetcher = p.Prefetcher()
 
         # Set widget display options
         self.myFont = tk.font.nametofont('TkDefaultFont').configure(size=10)
@@ -150,6 +163,13 @@ class MainFrame(ttk.Frame):
         # Set temporary instructions text in the first word label
         self.text_vars[0].set("Click the START button to begin.")
 
+        # Re-enable buttons once audio has finished playing. The 
+        # player reports finished (or interrupted) presentations 
+        # on its own thread, through this queue.
+        self._presentation = 0
+        self._playback_done = queue.Queue()
+        self.after(self.poll_ms, self._poll_playback)
+
         # Create list of checkbuttons for displaying beneath key words
         self.chk_vars = list(string.ascii_uppercase)
         self.word_chks = []
@@ -168,7 +188,9 @@ class MainFrame(ttk.Frame):
         """
         try:
             self.listmodel.load()
-            self.stim_master = self.listmodel.stim_master
+            self.trials = t.TrialSequence.from_frame(
+                self.listmodel.stim_master)
+            self.runner = self._make_runner(self.trials)
         except AttributeError:
             print("Views_Main_178: Problem loading stimuli!")
             self._reset()
@@ -186,22 +208,31 @@ class MainFrame(ttk.Frame):
             self.condition_var.set(f"Condition: {self.sessionpars['Condition'].get()}")
             self.speaker_var.set(f"Speaker: {self.sessionpars['Speaker Number'].get()}")
             self.list_var.set(f"List(s): {self.sessionpars['List Number'].get()}")
-            self.level_var.set(f"Level: {self.stim_master.loc[self.counter, 'level']}")
-            self.trial_var.set(f"Trial: {self.counter+1} of {len(self.stim_master)}")
+            self.level_var.set(f"Level: {self.runner.trial.level}")
+            self.trial_var.set(f"Trial: {self.runner.trial_num} of {len(self.trials)}")
         except AttributeError:
             print("Views_Main_189: Cannot calculate trials data: stimuli not yet loaded!")
 
 
+    def _make_runner(self, trials):
+        """ Create the trial runner for a session
+        """
+        return rm.TrialRunner(trials,
+            criterion=self.sessionpars['score_criterion'].get(),
+            player=self.player,
+            prefetcher=self.prefetcher,
+            on_result=self._on_result)
+
+
     def _get_level(self):
-        """ Send event to controller to calculate new 
-            raw level for the updated presentation level.
+        """ Look up the raw level and gain for the current 
+            trial's presentation level
         """
-        # Load level based on stim_master list
-        self.sessionpars['new_db_lvl'].set(self.stim_master.loc[self.counter, 'level'])
-        self._update_labels()
+        db_lvl, self.raw_lvl, _ = self.runner.level()
 
-        # Send event to controller
-        self.event_generate('<<GetLevel>>')
+        # Record levels for the data file
+        self.sessionpars['new_db_lvl'].set(db_lvl)
+        self.sessionpars['new_raw_lvl'].set(self.raw_lvl)
 
 
     def _enable_btns(self):
@@ -242,9 +273,56 @@ class MainFrame(ttk.Frame):
     # Button functions #
     ####################
     def _on_start(self):
-        """ Handle buttons, apply randomization, get first 
-            sentence, audio file and level, display/present
+        """ Load stimuli and apply randomization, then start
+            presenting
+        """
+        # Call listmodel load func to get latest lists
+        self._get_stimuli()
+
+        # Apply randomization if selected in session dialog
+        if self.sessionpars['randomize'].get() == 1:
+            print('\nViews_Main: Randomize = True')
+            try:
+                self._randomize()
+            except ValueError as e:
+                # Leave START available to try other options
+                messagebox.showerror(title="Randomization Failed",
+                    message="Could not create a trial order!",
+                    detail=f"{e}\nPlease check the randomization options.")
+                return
+            print('(Audio paths not printed below to save space)')
+            print(self.trials.to_frame().drop('audio', axis=1))
+        else:
+            print('\nViews_Main: Randomize = False')
+
+        self._begin()
+
+
+    def resume(self, trials, counter, seed):
+        """ Continue a session from a journal: present TRIALS 
+            (already in presentation order) starting at trial 
+            COUNTER. The sentence file and audio directory are 
+            not read.
         """
+        print(f"\nViews_Main: Resuming session at trial {counter+1}")
+        self.trials = trials
+        self.runner = self._make_runner(trials)
+        self.runner.seed = seed
+        self._begin(counter)
+
+
+    def _begin(self, counter=0):
+        """ Set up buttons and present trial COUNTER
+        """
+        # Calculate raw levels once for the whole session
+        self.runner.start(
+            slm_cal_value=self.sessionpars['slm_cal_value'].get(),
+            raw_lvl=self.sessionpars['raw_lvl'].get(),
+            counter=counter)
+        # Record offset and seed for the data file
+        self.sessionpars['slm_offset'].set(self.runner.levels.offset)
+        self.scoremodel.fields['Random Seed'] = self.runner.seed
+
         # Send event to controller to disable session menu
         # once task has started
         self.event_generate('<<MainStart>>')
@@ -257,22 +335,6 @@ class MainFrame(ttk.Frame):
         self.btn_repeat.grid(column=7, row=15,
         sticky='nsew', pady=(0,10))
 
-        # Call listmodel load func to get latest lists
-        self._get_stimuli()
-
-        # Apply randomization if selected in session dialog
-        if self.sessionpars['randomize'].get() == 1:
-            print('\nViews_Main: Randomize = True')
-            print('(Audio paths not printed below to save space)')
-            trials = list(self.stim_master.index)
-            random.shuffle(trials)
-            self.stim_master['order'] = trials
-            self.stim_master.sort_values(by='order', inplace=True)
-            self.stim_master.set_index('order', inplace=True)
-            print(self.stim_master.drop('audio', axis=1))
-        else:
-            print('\nViews_Main: Randomize = False')
-
         # Get presentation level
         self._get_level()
 
@@ -285,6 +347,19 @@ class MainFrame(ttk.Frame):
         self._play()
 
 
+    def _randomize(self):
+        """ Reorder trials using the seed and constraint from
+            the session dialog
+        """
+        seed = self.runner.randomize(
+            seed=self.sessionpars['random_seed'].get(),
+            constraint=self.sessionpars['random_constraint'].get(),
+            max_run=self.sessionpars['max_level_run'].get(),
+            session=self.sessionpars['session_number'].get()
+        )
+        print(f"Views_Main: Random seed: {seed}")
+
+
     def _on_next(self):
         """ Control the order of operations when NEXT 
             button is clicked
@@ -294,20 +369,16 @@ class MainFrame(ttk.Frame):
         # Reset word labels and checkbuttons
         self._reset()
         
-        if self.counter >= len(self.stim_master)-1:
+        if not self.runner.advance():
             print("Out of sentences!")
             self.text_vars[0].set("Done!")
-            self.trial_var.set(f"Trial {len(self.stim_master)} of " +
-                f"{len(self.stim_master)}")
+            self.trial_var.set(f"Trial {len(self.trials)} of " +
+                f"{len(self.trials)}")
             self.btn_next.config(state='disabled')
             #self.btn_wrong.config(state='disabled')
             self.event_generate('<<MainDone>>')
             return
 
-        # Update trial counter call before _get_level
-        # and _update_labels funcs
-        self.counter += 1
-        
         # Get next level and calculate dB FS
         self._get_level()
 
@@ -342,50 +413,65 @@ class MainFrame(ttk.Frame):
     def _play(self):
         """ Load next audio file and present it
         """
+        print(f"Views_Main_363: Raw level sent to audio object: " +
+            f"{self.raw_lvl}")
+
+        # Disable right/wrong buttons to prevent multiple clicks
+        self._disable_btns("Presenting")
+        # Update tasks is required before playing audio
+        # for _disable_btns to update the GUI
+        self.update()
+
+        # Present audio (numbered, so only the presentation 
+        # playing now can re-enable NEXT). The runner uses 
+        # prefetched audio if available, then starts loading
+        # the next trial while this one is scored.
+        self._presentation += 1
+        presentation = self._presentation
         try:
-            # Create audio object
-            print(f"Views_Main_363: Raw level sent to audio object: " +
-                f"{self.sessionpars['new_raw_lvl'].get()}")
-            audio = a.Audio(self.stim_master.loc[self.counter, 'audio'],
-                self.sessionpars['new_raw_lvl'].get())
-
-            # Disable right/wrong buttons to prevent multiple clicks
-            self._disable_btns("Presenting")
-            # Update tasks is required before playing audio
-            # for _disable_btns to update the GUI
-            self.update()
-
-            # Present audio
-            try:
-                audio.play(
-                    device_id=self.sessionpars['Audio Device ID'].get(),
-                    channels=self.sessionpars['Speaker Number'].get()
-                    )
-            except ValueError:
-                # Show error messagebox
-                messagebox.showerror(title="Invalid Audio Device",
-                    message="Please provide a valid audio device ID!")
-                # Give instructions in sentence label
-                self._reset()
-                self.text_vars[0].set("Please restart the application " +
-                    "to apply changes.")
-                # Open audio device dialog for user
-                self.event_generate('<<ToolsAudioSettings>>')
-                # Disable right/wrong buttons
-                self._disable_btns("Ready")
-                # Restore START button
-                self.btn_start.grid(column=7, row=15, rowspan=6, 
-                    sticky='nsew', pady=(0,10))
-                return
-
-            # Re-enable buttons after audio has finished playing
-            # NOTE: .after expects an integer duration in ms
-            self.after((int(np.ceil(audio.dur)))*1000, self._enable_btns)
-        except KeyError:
+            self.runner.present(
+                device_id=self.sessionpars['Audio Device ID'].get(),
+                channels=self.sessionpars['Speaker Number'].get(),
+                on_done=lambda: self._playback_done.put(presentation)
+                )
+        except ValueError:
+            # Show error messagebox
+            messagebox.showerror(title="Invalid Audio Device",
+                message="Please provide a valid audio device ID!")
+            # Give instructions in sentence label
+            self._reset()
+            self.text_vars[0].set("Please restart the application " +
+                "to apply changes.")
+            # Open audio device dialog for user
+            self.event_generate('<<ToolsAudioSettings>>')
+            # Disable right/wrong buttons
+            self._disable_btns("Ready")
+            # Restore START button
+            self.btn_start.grid(column=7, row=15, rowspan=6, 
+                sticky='nsew', pady=(0,10))
+        except OSError:
+            # Missing or unreadable file (e.g., network share 
+            # dropped): nothing is playing, so allow NEXT again
             messagebox.showerror(title="Cannot Find File",
                 message="Requested audio file does not exist!")
             print("Views_Main_354: Audio file does not exist!")
-            return
+            self._enable_btns()
+
+
+    def _poll_playback(self):
+        """ Enable NEXT once the latest presentation has 
+            finished (or was interrupted, e.g., by the 
+            calibration stimulus). Earlier presentations, 
+            e.g., one replaced by REPEAT, are ignored.
+        """
+        while True:
+            try:
+                presentation = self._playback_done.get_nowait()
+            except queue.Empty:
+                break
+            if presentation == self._presentation:
+                self._enable_btns()
+        self.after(self.poll_ms, self._poll_playback)
 
 
     ##################################
@@ -400,31 +486,26 @@ class MainFrame(ttk.Frame):
         # SELECT ALL button
         self.keyword_chks = []
         try:
-            # Get next sentence and split into a list of words
-            self.words = self.stim_master.loc[
-                self.counter, 'sentence'].split()
-            # Remove period from last word
-            if self.words[-1][-1] == '.':
-                self.words[-1] = self.words[-1][:-1]
-
-            # Display words and checkboxes
+            # Get next sentence's words and key word positions 
+            # (precomputed by the listmodel)
+            trial = self.runner.trial
+            self.words = trial.words
+            self.keyword_chks = list(trial.keywords)
+
+            # Display words
             for idx, word in enumerate(self.words):
-                if word.isupper() and word != 'A':
-                    # Words
-                    self.text_vars[idx].set(word)
-                    self.word_labels[idx].config(
-                        font=('TkDefaultFont 10 underline'))
-                    # Checkboxes
-                    self.word_chks[idx].grid(column=idx, row=1)
-                    self.keyword_chks.append(idx)
-                else:
-                    # Words
-                    self.text_vars[idx].set(word)
-        except KeyError:
+                self.text_vars[idx].set(word)
+
+            # Underline key words and display checkboxes
+            for idx in self.keyword_chks:
+                self.word_labels[idx].config(
+                    font=('TkDefaultFont 10 underline'))
+                self.word_chks[idx].grid(column=idx, row=1)
+        except IndexError:
             print("Out of sentences!")
             self.text_vars[0].set("Done!")
-            self.trial_var.set(f"Trial {len(self.stim_master)} of " +
-                f"{len(self.stim_master)}")
+            self.trial_var.set(f"Trial {len(self.trials)} of " +
+                f"{len(self.trials)}")
             self.btn_next.config(state='disabled')
             #self.btn_wrong.config(state='disabled')
             self.event_generate('<<MainDone>>')
@@ -435,39 +516,18 @@ class MainFrame(ttk.Frame):
     # Store correct response words #
     ################################
     def _score(self):
-        """ Get words marked correct and incorrect, update 
-            scoremodel, and send event to controller
+        """ Pass the key words marked correct to the runner
         """
-        # Get correct words
-        correct = []
-        for idx, value in enumerate(self.chk_vars):
-            if value.get() != 0:
-                correct.append(self.words[idx])
-
-        # Get incorrect words
-        # Exclude correct words from list of words
-        incorrect = list(set(self.words).difference(correct))
-        # Only take capitalized words
-        incorrect = [word for word in incorrect if word.isupper()]
-        # Remove 'A' if it exists (never a key word, but can be capital)
-        try:
-            incorrect.remove('A')
-        except ValueError:
-            # There was no 'A' in the list
-            pass
+        correct = [idx for idx in self.keyword_chks 
+            if self.chk_vars[idx].get() != 0]
+        self.runner.score(correct)
 
-        if len(correct) >= self.sessionpars['score_criterion'].get():
-            outcome = 1
-        else:
-            outcome = 0
-
-        # Update scoremodel with values
-        self.scoremodel.fields['Words Correct'] = ' '.join(correct)
-        self.scoremodel.fields['Num Words Correct'] = len(
-            self.scoremodel.fields['Words Correct'].split())
-        self.scoremodel.fields['Words Incorrect'] = ' '.join(incorrect)
-        self.scoremodel.fields['Trial'] = self.counter + 1
-        self.scoremodel.fields['Outcome'] = outcome
+
+    def _on_result(self, result):
+        """ Update scoremodel with a scored trial and send 
+            event to controller
+        """
+        self.scoremodel.fields.update(result)
 
         # Send event to controller to write response to file
         self.event_generate('<<SubmitResponse>>')
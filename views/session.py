@@ -11,6 +11,9 @@ from tkinter import filedialog
 from tkinter import messagebox
 from tktooltip import ToolTip
 
+# Import custom modules
+from models import randommodel as r
+
 
 #########
 # BEGIN #
@@ -53,6 +56,10 @@ class SessionDialog(tk.Toplevel):
         frm_sentencepath = ttk.Labelframe(self, text='Sentence File Directory')
         frm_sentencepath.grid(row=15, column=0, padx=10, pady=10, ipadx=5, ipady=5)
 
+        # Results database browser frame
+        frm_dbpath = ttk.Labelframe(self, text='Results Database (Optional)')
+        frm_dbpath.grid(row=16, column=0, padx=10, pady=10, ipadx=5, ipady=5)
+
 
         #######################
         # Create view widgets #
@@ -103,7 +110,36 @@ class SessionDialog(tk.Toplevel):
         #self.random_var = tk.IntVar(value=self.sessionpars['randomize'])
         chk_random = ttk.Checkbutton(frm_options, text="Randomize",
             takefocus=0, variable=self.sessionpars['randomize'])
-        chk_random.grid(row=7, column=0, sticky='e', **options)
+        chk_random.grid(row=7, column=0, sticky='w', **options)
+
+        # Randomization constraint
+        lbl_constraint = ttk.Label(frm_options, text="Constraint:")
+        lbl_constraint.grid(row=8, column=0, sticky='e', **options)
+        ttk.Combobox(frm_options, width=17, state='readonly',
+            values=r.Randomizer.constraints,
+            textvariable=self.sessionpars['random_constraint']
+            ).grid(row=8, column=1, sticky='w')
+
+        # Max level run
+        lbl_run = ttk.Label(frm_options, text="Max Level Run:")
+        lbl_run.grid(row=9, column=0, sticky='e', **options)
+        ttk.Entry(frm_options, width=20, 
+            textvariable=self.sessionpars['max_level_run']
+            ).grid(row=9, column=1, sticky='w')
+
+        # Session number
+        lbl_session = ttk.Label(frm_options, text="Session:")
+        lbl_session.grid(row=10, column=0, sticky='e', **options)
+        ttk.Entry(frm_options, width=20, 
+            textvariable=self.sessionpars['session_number']
+            ).grid(row=10, column=1, sticky='w')
+
+        # Seed
+        lbl_seed = ttk.Label(frm_options, text="Seed:")
+        lbl_seed.grid(row=11, column=0, sticky='e', **options)
+        ttk.Entry(frm_options, width=20, 
+            textvariable=self.sessionpars['random_seed']
+            ).grid(row=11, column=1, sticky='w')
 
         # Audio directory
         ttk.Label(frm_audiopath, text="Path:"
@@ -123,6 +159,18 @@ class SessionDialog(tk.Toplevel):
         ttk.Button(frm_sentencepath, text="Browse", command=self._get_sentence_directory
             ).grid(row=10, column=1, sticky='w', pady=(0, 5))
 
+        # Results database
+        lbl_db = ttk.Label(frm_dbpath, text="Path:")
+        lbl_db.grid(row=11, column=0, sticky='e', **options)
+        ttk.Label(frm_dbpath, textvariable=self.sessionpars['Results Database'], 
+            borderwidth=2, relief="solid", width=60
+            ).grid(row=11, column=1, columnspan=2, sticky='w')
+        ttk.Button(frm_dbpath, text="Browse", command=self._get_database
+            ).grid(row=12, column=1, sticky='w', pady=(0, 5))
+        ttk.Button(frm_dbpath, text="Clear", 
+            command=lambda: self.sessionpars['Results Database'].set('')
+            ).grid(row=12, column=2, sticky='w', pady=(0, 5))
+
         # Submit button
         btn_submit = ttk.Button(self, text="Submit", command=self._on_submit)
         btn_submit.grid(column=0, columnspan=2, row=20, pady=(0,10))
@@ -170,6 +218,40 @@ class SessionDialog(tk.Toplevel):
             delay=0.5
         )
 
+        ToolTip(
+            lbl_constraint, 
+            msg="None: shuffle all sentences.\n" +
+                "Max Level Run: limit same-level sentences in a row.\n" +
+                "Blocked By List: keep each list together.\n" +
+                "Latin Square: keep each list together, with list order\n" +
+                "counterbalanced across session numbers.",
+            delay=0.5
+        )
+
+        ToolTip(
+            lbl_run, 
+            msg="Maximum number of sentences in a row at the same level\n(Max Level Run only).",
+            delay=0.5
+        )
+
+        ToolTip(
+            lbl_session, 
+            msg="Session number for this subject (Latin Square only).",
+            delay=0.5
+        )
+
+        ToolTip(
+            lbl_db, 
+            msg="Also save every trial to this database, shared by all\nsessions. Leave blank to save .csv files only.",
+            delay=0.5
+        )
+
+        ToolTip(
+            lbl_seed, 
+            msg="Whole number to reproduce a previous order.\nLeave blank for a new random order. The seed used\nis written to the data file.",
+            delay=0.5
+        )
+
         # Center the session dialog window
         self.center_window()
 
@@ -206,6 +288,17 @@ class SessionDialog(tk.Toplevel):
             filedialog.askdirectory(title="Sentence File Directory"))
 
 
+    def _get_database(self):
+        """ Ask user to choose (or create) a results database
+            and store it in sessionpars
+        """
+        db_path = filedialog.asksaveasfilename(title="Results Database",
+            defaultextension='.db', confirmoverwrite=False,
+            filetypes=[('SQLite database', '*.db')])
+        if db_path:
+            self.sessionpars['Results Database'].set(db_path)
+
+
     def _chk_lengths(self):
         """ Validate the number of entered lists and presentations levels.
             If an invalid number exists, display an error message and return 
@@ -228,6 +321,23 @@ class SessionDialog(tk.Toplevel):
             return 'valid'
 
 
+    def _chk_seed(self):
+        """ Validate the randomization seed (blank or a 
+            non-negative whole number). If invalid, display an
+            error message and return invalid flag.
+        """
+        seed = self.sessionpars['random_seed'].get().strip()
+        if seed and not seed.isdigit():
+            messagebox.showerror(
+                title="Invalid Parameters",
+                message="Invalid seed!",
+                detail="Either leave the seed blank, or provide a whole number."
+            )
+            return 'invalid'
+        self.sessionpars['random_seed'].set(seed)
+        return 'valid'
+
+
     def _on_submit(self):
         """ Set new_db_lvl to specified presentation level.
             Send event to controller to write sessionpars data to file
@@ -241,6 +351,10 @@ class SessionDialog(tk.Toplevel):
         if list_lvl_num_chk == 'invalid':
             return
 
+        # Validate randomization seed
+        if self._chk_seed() == 'invalid':
+            return
+
         # Load listmodel
         print("\nViews_Session: Attempting to load listmodel stimuli")
         self.listmodel.load()